@@ -1,6 +1,9 @@
 import os
+import atexit
 import logging
+import logging.handlers
 import json
+import queue
 
 # Logging configuration (must run after importing os/logging)
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -19,9 +22,18 @@ if not logging.getLogger().handlers:
         file_handler = logging.FileHandler(LOG_FILE)
         file_handler.setFormatter(formatter)
         handlers.append(file_handler)
-    logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO), handlers=handlers)
+    # Schrijven naar stdout/bestand gebeurt in de listener-thread; de event loop zet records
+    # alleen in een queue en blokkeert dus niet op een trage pipe (docker logs, journald)
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))  # opmaak doen de echte handlers
+    logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.INFO), handlers=[queue_handler])
 
 logger = logging.getLogger("myenergi-marstek")
+control_log = logging.getLogger("myenergi-marstek.control")
 
 """
 Windsurf prompt — 1-file app (FastAPI) voor myenergi + Marstek met automatische regellogica.
@@ -46,35 +58,86 @@ Run:
 import os
 import time
 import asyncio
+import functools
+import gzip
+import hashlib
 import json
 import logging
+import math
+import mimetypes
+import re
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime
+from email.utils import formatdate
 from enum import Enum
-from typing import Any, Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 import httpx
 from fastapi import FastAPI, BackgroundTasks, Request, Query, Body, HTTPException
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from pydantic import BaseModel, conint, conlist
 from pymodbus.client import ModbusTcpClient
-from venus_e_register_map import format_value, get_all_sensors
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
+from venus_e_register_map import format_value, get_all_sensors, make_formatter
 from dotenv import load_dotenv
 
+# Snelle JSON decoder/encoder voor upstream en /api responses (valt terug op stdlib)
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+    JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    FastJSONResponse = JSONResponse
+    json_loads = json.loads
+    JSONDecodeError = json.JSONDecodeError
+
+    def json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+# uvloop (libuv) als event loop; uvicorn[standard] kiest die zelf al, dit dekt andere starters.
+# Windows heeft geen uvloop en blijft op de standaard (proactor) loop.
+if sys.platform != "win32":
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
+# HTTP/2 voor de myenergi cloud (httpx[http2] -> h2), anders gewoon HTTP/1.1
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 # BLE integration
 try:
     from ble_client import get_ble_client, cleanup_ble_client
     BLE_AVAILABLE = True
 except ImportError:
     BLE_AVAILABLE = False
-    print("⚠️  BLE not available (install: pip install bleak)")
+    logger.warning("⚠️  BLE not available (install: pip install bleak)")
 
 # =========================
 # Config
 # =========================
 load_dotenv()
 
+def _env_bool(key: str, default: str = "false") -> bool:
+    """Env-vlag als bool; "true"/"1"/"yes"/"on" (hoofdletterongevoelig) tellen als aan."""
+    return os.getenv(key, default).strip().lower() in ("true", "1", "yes", "on")
+
 ENV_DEFAULTS = {
     "MYENERGI_BASE_URL":   "https://s18.myenergi.net",
     "MYENERGI_HUB_SERIAL": "Z12345678",
@@ -91,7 +154,7 @@ MYENERGI_API_KEY    = os.getenv("MYENERGI_API_KEY",    ENV_DEFAULTS["MYENERGI_AP
 MARSTEK_BASE_URL    = os.getenv("MARSTEK_BASE_URL",    ENV_DEFAULTS["MARSTEK_BASE_URL"]).rstrip("/")
 MARSTEK_API_TOKEN   = os.getenv("MARSTEK_API_TOKEN",   ENV_DEFAULTS["MARSTEK_API_TOKEN"]).strip()
 MARSTEK_BLE_BRIDGE  = os.getenv("MARSTEK_BLE_BRIDGE",  ENV_DEFAULTS["MARSTEK_BLE_BRIDGE"]).rstrip("/")
-MARSTEK_USE_BLE     = os.getenv("MARSTEK_USE_BLE",     ENV_DEFAULTS["MARSTEK_USE_BLE"]).lower() == "true"
+MARSTEK_USE_BLE     = _env_bool("MARSTEK_USE_BLE",     ENV_DEFAULTS["MARSTEK_USE_BLE"])
 
 # Regellogica parameters (env-overrides mogelijk)
 EDDI_PRIORITY_MODE     = os.getenv("EDDI_PRIORITY_MODE", "threshold").lower() # "power", "temp", "threshold"
@@ -105,25 +168,99 @@ BATTERY_HYSTERESIS_W   = int(os.getenv("BATTERY_HYSTERESIS_W", "500"))       # A
 EDDI_TARGET_TEMP_1     = int(os.getenv("EDDI_TARGET_TEMP_1", "59"))          # Tank 1 doeltemperatuur (°C)
 EDDI_TARGET_TEMP_2     = int(os.getenv("EDDI_TARGET_TEMP_2", "59"))          # Tank 2 doeltemperatuur (°C)
 EDDI_TEMP_HYSTERESIS   = int(os.getenv("EDDI_TEMP_HYSTERESIS", "3"))         # Temperatuur hysterese (°C)
-EDDI_USE_TANK_1        = os.getenv("EDDI_USE_TANK_1", "true").lower() == "true"   # Tank 1 actief
-EDDI_USE_TANK_2        = os.getenv("EDDI_USE_TANK_2", "false").lower() == "true"  # Tank 2 actief
+EDDI_USE_TANK_1        = _env_bool("EDDI_USE_TANK_1", "true")                 # Tank 1 actief
+EDDI_USE_TANK_2        = _env_bool("EDDI_USE_TANK_2", "false")                # Tank 2 actief
 EXPORT_ENOUGH_W        = int(os.getenv("EXPORT_ENOUGH_W", "300"))
 IMPORT_DIP_W           = int(os.getenv("IMPORT_DIP_W", "150"))
 STABLE_EXPORT_SECONDS  = int(os.getenv("STABLE_EXPORT_SECONDS", "30"))
 MIN_SWITCH_COOLDOWN_S  = int(os.getenv("MIN_SWITCH_COOLDOWN_S", "60"))
 SOC_FAILSAFE_MIN       = int(os.getenv("SOC_FAILSAFE_MIN", "15"))
 POLL_INTERVAL_S        = float(os.getenv("POLL_INTERVAL_S", "2"))
+POLL_INTERVAL_MAX_S    = float(os.getenv("POLL_INTERVAL_MAX_S", "30"))      # Max interval bij stabiele situatie
+POLL_BACKOFF_FACTOR    = 1.5   # Interval groeit per stabiele tick met deze factor (tot het adaptieve plafond)
+POLL_STABLE_DELTA_W    = 50    # Export verandert minder dan dit → tick telt als stabiel
+
+# Afgeleide drempels (één keer bij import): hysterese-paar en reserves
+BATTERY_MIN_EXPORT_ON_W  = BATTERY_MIN_EXPORT_W + BATTERY_HYSTERESIS_W   # Geblokkeerd → export nodig om weer AAN te gaan
+BATTERY_MIN_EXPORT_OFF_W = BATTERY_MIN_EXPORT_W - BATTERY_HYSTERESIS_W   # Actief → onder deze export gaat hij UIT
+EDDI_ZAPPI_RESERVE_W     = EDDI_RESERVE_W + ZAPPI_RESERVE_W              # Reserve als Zappi ook wil laden
+# Threshold-modus: minimale export om de batterij toe te laten, per (geblokkeerd, zappi > 0)
+EXPORT_NEEDED_W = {
+    (blocked, zappi): max(BATTERY_MIN_EXPORT_ON_W if blocked else BATTERY_MIN_EXPORT_OFF_W,
+                          EDDI_ZAPPI_RESERVE_W if zappi else EDDI_RESERVE_W)
+    for blocked in (False, True) for zappi in (False, True)
+}
 
 # Battery capacity (kWh) for SoC → kWh calculations
 BATTERY_FULL_KWH      = float(os.getenv("BATTERY_FULL_KWH", "5.12"))
 # Minimum SoC reserve (%) that must remain in the battery (manual/auto rules)
 MIN_SOC_RESERVE       = int(os.getenv("MIN_SOC_RESERVE", "10"))
 
+# Map voor runtime-state (o.a. het geleerde Marstek endpoint)
+MARSTEK_STATE_DIR     = os.getenv("MARSTEK_STATE_DIR", ".")
+
+# Server: aantal uvicorn workers (python app.py) en of deze instantie de regelloop draait.
+# Met meerdere workers draait alleen de worker die de lock in MARSTEK_STATE_DIR krijgt de loop.
+WEB_WORKERS           = int(os.getenv("WEB_WORKERS", "1"))
+CONTROL_LOOP_LEADER   = _env_bool("CONTROL_LOOP_LEADER", "0")
+
 USER_AGENT = {"User-Agent": "Wget/1.14 (linux-gnu)"}
 
+# Marstek HTTP paden (overview, probe en scan) en standaard poorten voor de netwerk scan
+_SCAN_PATHS = ("/api/overview", "/overview", "/api/status", "/status", "/api", "/")
+_DEFAULT_SCAN_PORTS = (30000, 30001, 8080, 80, 30002)
+# Gelijktijdige HTTP pogingen per scan (payload "concurrency" wordt hierbinnen geklemd)
+SCAN_CONCURRENCY_DEFAULT = 32
+SCAN_CONCURRENCY_MAX = 128
+SCAN_TCP_TIMEOUT_S = 0.5  # TCP voorcheck per ip:poort; pas daarna de HTTP paden
+# status_all haalt hooguit eens per MYENERGI_STATUS_TTL_S op (ttl_cached, gedeeld door alle aanroepers);
+# zonder wildcard kost dat 3 requests (Z/E/H). De standaard token bucket dekt dat slechtste geval, zodat de
+# bucket niet binnen status_all gaat slapen terwijl sample_all myenergi_lock vasthoudt. Een lagere
+# MYENERGI_MAX_REQ_PER_MIN kan, maar rekt dan elke control tick en /api/status op tot de bucket weer ruimte heeft.
+MYENERGI_STATUS_TTL_S = POLL_INTERVAL_S * 0.8
+MYENERGI_REQ_PER_STATUS = 3
+MYENERGI_MAX_REQ_PER_MIN = int(os.getenv(
+    "MYENERGI_MAX_REQ_PER_MIN", str(math.ceil(MYENERGI_REQ_PER_STATUS * 60 / MYENERGI_STATUS_TTL_S))))
+MYENERGI_MAX_RESPONSE_BYTES = 1024 * 1024  # jstatus is een paar KB; groter = iets mis upstream
+
 # =========================
 # Modbus Client for Venus E Battery 78
 # =========================
+# Key registers (preferred v2 mapping + a few legacy extras) als vaste (adres, naam) paren
+REGISTERS_V2 = (
+    (32104, "soc_percent"),      # %
+    (32100, "battery_voltage"),  # V 
+    (32101, "battery_current"),  # A (signed)
+    (32102, "battery_power"),    # W (signed) - holding register, int32
+    (35100, "work_mode"),        # enum
+    # Control/Setpoint registers (holding)
+    (42000, "rs485_control_enable"),     # 0/1 or magic token
+    (42010, "control_mode_command"),     # 0=Stop,1=Charge,2=Discharge
+    (42020, "charge_setpoint_power"),    # W
+    (42021, "discharge_setpoint_power"), # W
+    (43000, "user_work_mode"),           # 0=Manual, 1=Anti-Feed, 2=Trade Mode
+    # Legacy/extras we still show if available
+    (30006, "system_status"),
+    (30008, "cycle_count"),
+    (30010, "internal_temp"),
+)
+REGISTERS_V2_ADDRS = frozenset(addr for addr, _ in REGISTERS_V2)
+# Per adres een formatter met de registerinfo al opgezocht (zelfde uitvoer als format_value)
+REGISTER_FORMATTERS = {addr: make_formatter(addr) for addr in REGISTERS_V2_ADDRS}
+
+def _register_blocks(addresses, max_gap: int = 4) -> List[Tuple[int, int]]:
+    """Adressen groeperen tot (start, count) blokken; tussenliggende registers (gat <= max_gap) lezen we mee."""
+    blocks: List[List[int]] = []
+    for addr in sorted(addresses):
+        if blocks and addr - blocks[-1][1] <= max_gap:
+            blocks[-1][1] = addr
+        else:
+            blocks.append([addr, addr])
+    return [(first, last - first + 1) for first, last in blocks]
+
+# 32100-32104, 30006-30010 en 42020-42021 elk in één PDU
+BATTERY_READ_BLOCKS = _register_blocks(REGISTERS_V2_ADDRS)
+
 class VenusEModbusClient:
     def __init__(self, host=None, port=None):
         env_host = os.getenv('VENUS_MODBUS_HOST')
@@ -135,73 +272,87 @@ class VenusEModbusClient:
             self.port = 502
         self.client = None
         self.connected = False
+        self._client_addr: Optional[tuple] = None
+        # (unit, keyword-stijl) van de laatste geslaagde write; blijft geldig voor de levensduur van het proces
+        self._working_write: Optional[Tuple[int, str]] = None
     
     def connect(self):
         try:
-            # Add a short timeout to avoid hanging sockets
-            self.client = ModbusTcpClient(self.host, port=self.port, timeout=2)
+            # Eén client per host:port; connect() op een al open socket doet niets
+            if self.client is None or self._client_addr != (self.host, self.port):
+                if self.client is not None:
+                    self.client.close()
+                # Add a short timeout to avoid hanging sockets; retry doen we zelf (reconnect)
+                self.client = ModbusTcpClient(self.host, port=self.port, timeout=2, retries=0)
+                self._client_addr = (self.host, self.port)
             self.connected = self.client.connect()
             return self.connected
         except Exception as e:
             logging.error(f"Modbus connection error: {e}")
             return False
+
+    def ensure_connected(self) -> bool:
+        """Socket over polls/commando's heen hergebruiken; alleen opnieuw verbinden als die dicht is."""
+        if self.connected and self.client is not None and self.client.is_socket_open():
+            return True
+        return self.connect()
     
     def disconnect(self):
         if self.client:
             self.client.close()
             self.connected = False
 
+    def _read_block(self, start: int, count: int) -> Optional[List[int]]:
+        """read_holding_registers met één retry na reconnect; None als het apparaat weigert."""
+        result = self.client.read_holding_registers(address=start, count=count, slave=1)
+        if (not hasattr(result, 'registers')) or result.isError():
+            # retry once after reconnect
+            self.disconnect()
+            if self.connect():
+                result = self.client.read_holding_registers(address=start, count=count, slave=1)
+        if hasattr(result, 'registers') and not result.isError():
+            return result.registers
+        return None
+
     def read_battery_data(self):
         """Read all battery data from Venus E via Modbus"""
-        if not self.connected:
-            if not self.connect():
-                return None
+        if not self.ensure_connected():
+            return None
 
         battery_data = {}
 
-        # Read key registers (preferred v2 mapping + a few legacy extras)
-        registers = {
-            32104: "soc_percent",      # %
-            32100: "battery_voltage",  # V 
-            32101: "battery_current",  # A (signed)
-            32102: "battery_power",    # W (signed) - holding register, int32
-            35100: "work_mode",        # enum
-            # Control/Setpoint registers (holding)
-            42000: "rs485_control_enable",     # 0/1 or magic token
-            42010: "control_mode_command",     # 0=Stop,1=Charge,2=Discharge
-            42020: "charge_setpoint_power",    # W
-            42021: "discharge_setpoint_power", # W
-            43000: "user_work_mode",           # 0=Manual, 1=Anti-Feed, 2=Trade Mode
-            # Legacy/extras we still show if available
-            30006: "system_status",
-            30008: "cycle_count",
-            30010: "internal_temp",
-        }
-        
-        for reg_addr, param_name in registers.items():
+        # Eén read per blok aaneengesloten registers i.p.v. één round-trip per register
+        raw: Dict[int, int] = {}
+        for start, count in BATTERY_READ_BLOCKS:
             try:
-                result = self.client.read_holding_registers(address=reg_addr, count=1, slave=1)
-                if (not hasattr(result, 'registers')) or result.isError():
-                    # retry once after reconnect
-                    self.disconnect()
-                    if self.connect():
-                        result = self.client.read_holding_registers(address=reg_addr, count=1, slave=1)
-                
-                if hasattr(result, 'registers') and not result.isError():
-                    raw_value = result.registers[0]
-                    formatted = format_value(reg_addr, raw_value)
-                    
-                    battery_data[param_name] = {
-                        "value": formatted.get("value", raw_value),
-                        "formatted": formatted.get("formatted", str(raw_value)),
-                        "unit": formatted.get("unit", ""),
-                        "description": formatted.get("description", param_name),
-                        "register": reg_addr,
-                        "timestamp": datetime.now().isoformat()
-                    }
-                    
+                regs = self._read_block(start, count)
+                if regs is not None:
+                    raw.update(zip(range(start, start + count), regs))
+                elif count > 1:
+                    # Blok geweigerd (bv. ongemapt register in het gat): dan per register
+                    for reg_addr in range(start, start + count):
+                        if reg_addr in REGISTERS_V2_ADDRS:
+                            regs = self._read_block(reg_addr, 1)
+                            if regs is not None:
+                                raw[reg_addr] = regs[0]
             except Exception as e:
-                logging.error(f"Error reading register {reg_addr}: {e}")
+                logging.error(f"Error reading registers {start}-{start + count - 1}: {e}")
+
+        # Eén tijdstempel voor de hele uitlezing (alle registers komen uit dezelfde poll)
+        timestamp = datetime.now().isoformat()
+        for reg_addr, param_name in REGISTERS_V2:
+            raw_value = raw.get(reg_addr)
+            if raw_value is None:
+                continue
+            formatted = REGISTER_FORMATTERS[reg_addr](raw_value)
+            battery_data[param_name] = {
+                "value": formatted.get("value", raw_value),
+                "formatted": formatted.get("formatted", str(raw_value)),
+                "unit": formatted.get("unit", ""),
+                "description": formatted.get("description", param_name),
+                "register": reg_addr,
+                "timestamp": timestamp
+            }
         
         # Calculate actual power from voltage × current if we have both
         if "battery_voltage" in battery_data and "battery_current" in battery_data:
@@ -219,7 +370,7 @@ class VenusEModbusClient:
                 "unit": "W", 
                 "description": "Battery Power (calculated)",
                 "register": "calc",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": timestamp
             }
             logging.info(f"Calculated power: {voltage}V × {current}A = {calculated_power}W, scaled = {scaled_power}W")
         
@@ -228,36 +379,39 @@ class VenusEModbusClient:
     # -------------------------
     # Control helpers (holding registers)
     # -------------------------
+    def _try_write(self, address: int, value: int, unit: int, style: str) -> dict:
+        """Eén write_register poging met unit-ID via 'unit=' of 'slave=' keyword."""
+        ok = False
+        err = None
+        try:
+            rr = self.client.write_register(address=address, value=value, **{style: unit})
+            ok = (not getattr(rr, 'isError', lambda: False)())
+        except Exception as ex:
+            err = str(ex)
+        return {"unit": unit, "style": style, "ok": ok, "error": err}
+
     def write_holding(self, address: int, value: int) -> tuple[bool, list[dict]]:
         attempts: list[dict] = []
         try:
-            if not self.connected and not self.connect():
+            if not self.ensure_connected():
                 return False, attempts
+            # Eerder werkende (unit, style) eerst: na de eerste write is dat één round-trip
+            if self._working_write is not None:
+                attempt = self._try_write(address, value, *self._working_write)
+                attempts.append(attempt)
+                if attempt["ok"]:
+                    return True, attempts
             # Try a range of common unit IDs and both keyword styles (unit/slave)
             units_to_try = list(range(1, 11)) + [0, 247]
             for unit in units_to_try:
-                # First try 'unit='
-                ok = False
-                err = None
-                try:
-                    rr = self.client.write_register(address=address, value=value, unit=unit)
-                    ok = (not getattr(rr, 'isError', lambda: False)())
-                except Exception as ex:
-                    err = str(ex)
-                attempts.append({"unit": unit, "style": "unit", "ok": ok, "error": err})
-                if ok:
-                    return True, attempts
-                # Then try 'slave='
-                ok2 = False
-                err2 = None
-                try:
-                    rr2 = self.client.write_register(address=address, value=value, slave=unit)
-                    ok2 = (not getattr(rr2, 'isError', lambda: False)())
-                except Exception as ex2:
-                    err2 = str(ex2)
-                attempts.append({"unit": unit, "style": "slave", "ok": ok2, "error": err2})
-                if ok2:
-                    return True, attempts
+                for style in ("unit", "slave"):
+                    if (unit, style) == self._working_write:
+                        continue  # zojuist al geprobeerd
+                    attempt = self._try_write(address, value, unit, style)
+                    attempts.append(attempt)
+                    if attempt["ok"]:
+                        self._working_write = (unit, style)
+                        return True, attempts
             return False, attempts
         except Exception as e:
             logging.error(f"Modbus write error @ {address}: {e}")
@@ -279,7 +433,7 @@ class VenusEModbusClient:
             return result
 
         try:
-            if not self.connected and not self.connect():
+            if not self.ensure_connected():
                 result["error"] = "connect failed"
                 return result
 
@@ -292,11 +446,7 @@ class VenusEModbusClient:
                 return result
 
             # Small delay after enabling control
-            try:
-                import time as _t
-                _t.sleep(0.1)
-            except Exception:
-                pass
+            time.sleep(0.1)
 
             # Step 2: Set user work mode to register 43000
             ok_mode, tries_mode = self.write_holding(REG_USER_WORK_MODE, mode)
@@ -307,11 +457,7 @@ class VenusEModbusClient:
                 return result
 
             # Small delay after setting mode
-            try:
-                import time as _t
-                _t.sleep(0.1)
-            except Exception:
-                pass
+            time.sleep(0.1)
 
             # Step 3: Disable RS485 control (let app manage battery again)
             ok_disable, tries_disable = self.write_holding(REG_CONTROL_MODE, CONTROL_DISABLE)
@@ -335,11 +481,10 @@ class VenusEModbusClient:
                 "mode_name": mode_names.get(mode, f"Mode {mode}")
             })
             return result
-        finally:
-            try:
-                self.disconnect()
-            except Exception:
-                pass
+        except Exception:
+            # Socket in onbekende staat na een fout: volgende aanroep verbindt opnieuw
+            self.disconnect()
+            raise
 
     def check_minimum_soc(self, min_soc_percent: float = 20.0, hysteresis: float = 2.0) -> dict:
         """Check if current SoC is above minimum and take action if needed
@@ -411,7 +556,7 @@ class VenusEModbusClient:
         result = {"ok": False, "attempts": []}
         power_w = max(0, int(power_w or 0))
 
-        if not self.connected and not self.connect():
+        if not self.ensure_connected():
             result["error"] = "connect failed"
             return result
 
@@ -475,6 +620,15 @@ venus_modbus2 = VenusEModbusClient(host=os.getenv('VENUS_MODBUS_HOST2', '192.168
 # Ensure only one Modbus read at a time (per device)
 modbus_lock = asyncio.Lock()
 modbus_lock2 = asyncio.Lock()
+# pymodbus is synchroon: calls lopen in één eigen worker-thread per batterij (het apparaat
+# serialiseert toch), zodat de event loop niet op socket round-trips wacht
+modbus_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="modbus1")
+modbus_executor2 = ThreadPoolExecutor(max_workers=1, thread_name_prefix="modbus2")
+
+async def run_modbus(fn: Callable[..., Any], *args: Any, executor: ThreadPoolExecutor = modbus_executor,
+                     **kwargs: Any) -> Any:
+    """Blokkerende Modbus-call uitvoeren in de worker-thread van de batterij."""
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args, **kwargs))
 
 # Battery configuration management
 BATTERY_CONFIG_FILE = "battery_config.json"
@@ -510,12 +664,142 @@ def save_battery_config(config: dict) -> bool:
         logging.error(f"Could not save battery config: {e}")
         return False
 
+# Learned Marstek endpoint per base_url, so a restart skips the port/path scan
+MARSTEK_ENDPOINT_FILE = os.path.join(MARSTEK_STATE_DIR, "marstek_endpoint.json")
+
+def load_marstek_endpoints() -> Dict[str, str]:
+    """Load learned Marstek endpoints ({base_url: url}) from file"""
+    try:
+        if os.path.exists(MARSTEK_ENDPOINT_FILE):
+            with open(MARSTEK_ENDPOINT_FILE, 'r') as f:
+                return json.load(f)
+    except Exception as e:
+        logging.warning(f"Could not load Marstek endpoint cache: {e}")
+    return {}
+
+def save_marstek_endpoint(base_url: str, url: str) -> bool:
+    """Persist the working endpoint for base_url"""
+    try:
+        endpoints = load_marstek_endpoints()
+        endpoints[base_url] = url
+        with open(MARSTEK_ENDPOINT_FILE, 'w') as f:
+            json.dump(endpoints, f, indent=2)
+        return True
+    except Exception as e:
+        logging.error(f"Could not save Marstek endpoint cache: {e}")
+        return False
+
+def forget_marstek_endpoint(base_url: str) -> bool:
+    """Drop the learned endpoint for base_url (e.g. after it stopped answering)"""
+    try:
+        endpoints = load_marstek_endpoints()
+        if endpoints.pop(base_url, None) is None:
+            return True
+        with open(MARSTEK_ENDPOINT_FILE, 'w') as f:
+            json.dump(endpoints, f, indent=2)
+        return True
+    except Exception as e:
+        logging.error(f"Could not update Marstek endpoint cache: {e}")
+        return False
+
 # Lock to prevent concurrent requests to the MyEnergi API, which can cause auth issues
 myenergi_lock = asyncio.Lock()
 
 # =========================
 # Clients
 # =========================
+class _TtlCache:
+    """Eén gecachte waarde met vervaltijd (monotonic) en de eventueel lopende fetch."""
+    __slots__ = ("value", "expiry", "inflight")
+
+    def __init__(self):
+        self.value: Any = None
+        self.expiry: float = 0.0
+        self.inflight: Optional[asyncio.Future] = None
+
+def ttl_cached(ttl: float):
+    """Cache het resultaat van een async methode zonder argumenten per instance voor `ttl` seconden.
+    Single-flight: gelijktijdige aanroepers (control_loop, /api/status, meerdere dashboards) wachten
+    op dezelfde fetch. Alleen succesvolle resultaten worden bewaard; exceptions gaan gewoon door."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(self):
+            caches = self.__dict__.setdefault("_ttl_caches", {})
+            entry = caches.get(fn.__name__)
+            if entry is None:
+                entry = caches[fn.__name__] = _TtlCache()
+            if time.monotonic() < entry.expiry:
+                return entry.value
+            task = entry.inflight
+            if task is None:
+                task = entry.inflight = asyncio.ensure_future(fn(self))
+
+                def _done(t: asyncio.Future, entry: _TtlCache = entry):
+                    entry.inflight = None
+                    if not t.cancelled() and t.exception() is None:
+                        entry.value, entry.expiry = t.result(), time.monotonic() + ttl
+
+                task.add_done_callback(_done)
+            # shield: een geannuleerde aanroeper breekt de fetch voor de anderen niet af
+            return await asyncio.shield(task)
+        return wrapper
+    return decorator
+
+def invalidate_ttl_cache(obj: Any):
+    """Vergeet alle via @ttl_cached bewaarde waarden van `obj` (bv. na een stuurcommando)."""
+    obj.__dict__.get("_ttl_caches", {}).clear()
+
+class _TokenBucket:
+    """Async token bucket: gemiddeld max `rate` requests per `period` seconden, burst tot `rate`."""
+    __slots__ = ("rate", "period", "tokens", "updated", "_lock")
+
+    def __init__(self, rate: int, period: float):
+        self.rate = rate
+        self.period = period
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.period)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.period / self.rate)
+
+def sniff_body(r: httpx.Response) -> tuple[str, Any]:
+    """("json", data) of ("text", str): alleen JSON parsen als content-type of eerste byte erop wijst,
+    zodat platte tekst geen exception-pad kost."""
+    body = r.content.lstrip()
+    if "json" in r.headers.get("content-type", "") or body[:1] in (b"{", b"["):
+        try:
+            return "json", json_loads(body)
+        except ValueError:
+            pass
+    return "text", r.text.strip()
+
+async def tcp_open(ip: str, port: int, timeout: float = SCAN_TCP_TIMEOUT_S) -> bool:
+    """Goedkope TCP connect: True als er iets luistert. Dichte/gefilterde poorten kosten
+    zo hooguit `timeout` in plaats van een volle HTTP timeout per pad."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (OSError, ValueError, asyncio.TimeoutError):
+        # ValueError: o.a. UnicodeError uit idna bij een ongeldige hostnaam (label te lang/leeg)
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+class MyEnergiResponseTooLarge(RuntimeError):
+    """myenergi antwoord boven MYENERGI_MAX_RESPONSE_BYTES; zegt niets over ondersteuning van het endpoint."""
+
 class MyEnergiClient:
     """
     Leest myenergi via cloud (Digest) of lokaal (Basic).
@@ -523,80 +807,233 @@ class MyEnergiClient:
     Lokaal: base_url http(s)://hub-ip -> Basic auth.
     """
 
-    def __init__(self, base_url: str, hub_serial: str, api_key: str, timeout: float = 5.0):
+    def __init__(self, base_url: str, hub_serial: str, api_key: str, timeout: float = 5.0,
+                 client: Optional[httpx.AsyncClient] = None):
         self.base_url = base_url.rstrip("/")
         self.hub_serial = hub_serial
         self.api_key = api_key
         self.timeout = timeout
         self.is_cloud = self.base_url.startswith("https://s") and ".myenergi.net" in self.base_url
+        # Auth/headers één keer opbouwen; DigestAuth houdt zo zijn nonce-state over requests heen
+        self._auth_obj = httpx.DigestAuth(hub_serial, api_key) if self.is_cloud else (hub_serial, api_key)
+        self._headers_obj: Dict[str, str] = dict(USER_AGENT) if self.is_cloud else {}
+        # Eén langlevende client: keepalive + hergebruik van de Digest challenge per poll.
+        # Cloud over HTTP/2: Z/E/H fallback requests delen één verbinding.
+        http2 = self.is_cloud and HTTP2_AVAILABLE
+        # Begrenzing richting upstream: max 3 tegelijk (Z/E/H fallback), cloud ook per minuut
+        self._sem = asyncio.Semaphore(3)
+        self._bucket = _TokenBucket(MYENERGI_MAX_REQ_PER_MIN, 60.0) if self.is_cloud else None
+        # Ongewijzigde responses leveren hetzelfde object op (path -> (body, data)), zodat
+        # parse_myenergi's identiteits-memo en de regelaar "niets veranderd" goedkoop herkennen
+        self._last_body: Dict[str, tuple] = {}
+        self._last_status: Optional[Dict[str, Any]] = None
+        # None = nog onbekend; False = server ondersteunt /cgi-jstatus-* niet (voor de levensduur van het proces)
+        self._wildcard_ok: Optional[bool] = None
+        # Meegegeven client (met auth/headers al ingesteld) is van de aanroeper en wordt hier niet gesloten
+        self._owns_client = client is None
+        self._client = client or httpx.AsyncClient(
+            timeout=timeout,
+            auth=self._auth(),
+            headers=self._headers(),
+            transport=httpx.AsyncHTTPTransport(
+                http2=http2,
+                retries=1,  # één retry bij connect-fouten (netwerk blips)
+                # Harde bovengrens; over h2 volstaat één verbinding voor alle streams
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=60),
+            ),
+        )
 
     def _auth(self):
-        if self.is_cloud:
-            return httpx.DigestAuth(self.hub_serial, self.api_key)
-        return (self.hub_serial, self.api_key)
+        return self._auth_obj
 
     def _headers(self) -> Dict[str, str]:
-        return USER_AGENT if self.is_cloud else {}
+        return self._headers_obj
+
+    async def aclose(self):
+        if self._owns_client:
+            await self._client.aclose()
 
     async def _get(self, path: str) -> Any:
-        url = f"{self.base_url}{path}"
-        async with httpx.AsyncClient(timeout=self.timeout, auth=self._auth(), headers=self._headers()) as client:
-            r = await client.get(url)
+        if self._bucket is not None:
+            await self._bucket.acquire()
+        # Streamend lezen met limiet: nooit een onverwacht grote response bufferen
+        async with self._sem, self._client.stream("GET", f"{self.base_url}{path}") as r:
             r.raise_for_status()
-            return r.json()
+            chunks, size = [], 0
+            async for chunk in r.aiter_bytes():
+                size += len(chunk)
+                if size > MYENERGI_MAX_RESPONSE_BYTES:
+                    raise MyEnergiResponseTooLarge(f"myenergi response groter dan {MYENERGI_MAX_RESPONSE_BYTES} bytes")
+                chunks.append(chunk)
+        body = b"".join(chunks)
+        # Bytes vergelijken i.p.v. een hash: geen kans op een botsing die oude data teruggeeft
+        prev = self._last_body.get(path)
+        if prev is not None and prev[0] == body:
+            return prev[1]
+        data = json_loads(body)
+        self._last_body[path] = (body, data)
+        return data
+
+    def _same_or_new(self, status: Dict[str, Any]) -> Dict[str, Any]:
+        """Vorige status teruggeven als alle delen dezelfde objecten zijn (niets veranderd)."""
+        prev = self._last_status
+        if prev is not None and prev.keys() == status.keys() and all(prev[k] is v for k, v in status.items()):
+            return prev
+        self._last_status = status
+        # Eén keer parsen waar de payload ontstaat; extractors lezen daarna de memo op identiteit.
+        # Niet in de dict zelf opslaan: die gaat als myenergi_raw ongewijzigd de API uit.
+        parse_myenergi(status)
+        return status
 
+    @ttl_cached(MYENERGI_STATUS_TTL_S)
     async def status_all(self) -> Dict[str, Any]:
         """Probeer wildcard, val terug op specifieke endpoints."""
         # Sommige servers accepteren /cgi-jstatus-* (alles), anders apart per type.
-        try:
-            data = await self._get("/cgi-jstatus-*")
-            return {"raw": data}
-        except Exception:
-            results: Dict[str, Any] = {}
-            for code, key in [("Z", "zappi"), ("E", "eddi"), ("H", "harvi")]:
-                try:
-                    results[key] = await self._get(f"/cgi-jstatus-{code}")
-                except Exception:
-                    results[key] = None
-            return results
+        # Eenmaal geweigerd (4xx/geen JSON) wordt de wildcard niet meer geprobeerd.
+        if self._wildcard_ok is not False:
+            try:
+                data = await self._get("/cgi-jstatus-*")
+                self._wildcard_ok = True
+                return self._same_or_new({"raw": data})
+            except httpx.HTTPStatusError as e:
+                # 401/429 zeggen niets over ondersteuning van de wildcard
+                if 400 <= e.response.status_code < 500 and e.response.status_code not in (401, 429):
+                    self._wildcard_ok = False
+            except JSONDecodeError:
+                # 2xx (raise_for_status ging vooraf) maar geen JSON: wildcard niet ondersteund
+                self._wildcard_ok = False
+            except Exception:
+                pass  # o.a. te groot antwoord of netwerkfout: volgende keer gewoon opnieuw
+        # Per type tegelijk ophalen: één RTT i.p.v. drie achter elkaar
+        zres, eres, hres = await asyncio.gather(
+            self._get("/cgi-jstatus-Z"),
+            self._get("/cgi-jstatus-E"),
+            self._get("/cgi-jstatus-H"),
+            return_exceptions=True,
+        )
+        return self._same_or_new({
+            key: (None if isinstance(res, Exception) else res)
+            for key, res in (("zappi", zres), ("eddi", eres), ("harvi", hres))
+        })
+
+# method -> geserialiseerd JSON-RPC verzoek (bytes) voor calls zonder params
+_UDP_REQUESTS: Dict[str, bytes] = {}
+
+class _UdpRpcProtocol(asyncio.DatagramProtocol):
+    """Eén UDP JSON-RPC uitwisseling: het eerste datagram (of een socketfout) vult de future."""
+
+    def __init__(self, fut: asyncio.Future):
+        self.fut = fut
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if not self.fut.done():
+            self.fut.set_result(data)
+
+    def error_received(self, exc: Exception) -> None:
+        # bv. ICMP port unreachable: direct falen i.p.v. de timeout uitzitten
+        if not self.fut.done():
+            self.fut.set_exception(exc)
 
 class MarstekClient:
     """
     Placeholder voor Marstek batterij. Pas endpoints/velden aan jouw model.
     """
-    def __init__(self, base_url: str, token: Optional[str] = None, timeout: float = 5.0):
+    NEGATIVE_TTL_S = 60.0  # 404-paden zolang niet opnieuw proberen
+
+    def __init__(self, base_url: str, token: Optional[str] = None, timeout: float = 5.0,
+                 client: Optional[httpx.AsyncClient] = None, persist_endpoint: bool = True):
         self.base_url = base_url.rstrip("/")
+        # Alleen de client van de regelaar schrijft het geleerde endpoint naar disk
+        self._persist_endpoint = persist_endpoint
         self.token = token
         self.timeout = timeout
+        # base_url één keer ontleden (UDP host, probe-kandidaten); zonder scheme geldt http
+        parts = urlsplit(self.base_url if "://" in self.base_url else f"http://{self.base_url}")
+        self._scheme = parts.scheme or "http"
+        self._host = parts.hostname or self.base_url
+        self._netloc = parts.netloc
+        try:
+            self._port: Optional[int] = parts.port
+        except ValueError:
+            self._port = None
+        self._udp_port = int(os.getenv("MARSTEK_UDP_PORT", "30000"))
+        # Kandidaat-URL's voor get_overview één keer opbouwen i.p.v. per poll
+        self._overview_urls = tuple(f"{self.base_url}{p}" for p in _SCAN_PATHS)
+        # BLE of netwerk ligt vast per client (config + beschikbaarheid bleak)
+        self._use_ble = MARSTEK_USE_BLE and BLE_AVAILABLE
+        # Werkende URL (geleerd via probe/get_overview, bewaard op disk); get_overview probeert die eerst
+        self._hit_url: Optional[str] = load_marstek_endpoints().get(self.base_url)
+        # url -> monotonic vervaltijd voor paden die 404 gaven
+        self._misses: Dict[str, float] = {}
+        # True zodra een endpoint geldige JSON gaf: tekst-fallback is dan alleen nog probe-werk
+        self._json_only = False
+        # Batterij-firmware kan weinig parallelle verbindingen aan
+        self._sem = asyncio.Semaphore(2)
+        self._headers_obj: Dict[str, str] = {"Accept": "application/json", "Accept-Encoding": "gzip, deflate"}
+        if token:
+            self._headers_obj["Authorization"] = f"Bearer {token}"
+        self._owns_client = client is None
+        self._client = client or httpx.AsyncClient(
+            timeout=timeout,
+            headers=self._headers(),
+            limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=60),
+        )
 
     def _headers(self) -> Dict[str, str]:
-        h = {"Accept": "application/json"}
-        if self.token:
-            h["Authorization"] = f"Bearer {self.token}"
-        return h
+        return self._headers_obj
+
+    async def aclose(self):
+        if self._owns_client:
+            await self._client.aclose()
+
+    def _learn_hit(self, url: str):
+        if url != self._hit_url:
+            self._hit_url = url
+            if self._persist_endpoint:
+                save_marstek_endpoint(self.base_url, url)
+
+    def _forget_hit(self):
+        """Geleerd endpoint werkt niet meer: vergeten (ook op disk), base_url kandidaten gaan weer voor."""
+        if self._hit_url is not None:
+            self._hit_url = None
+            if self._persist_endpoint:
+                forget_marstek_endpoint(self.base_url)
+
+    def _known_miss(self, url: str) -> bool:
+        expiry = self._misses.get(url)
+        return expiry is not None and expiry > time.monotonic()
+
+    async def _fetch(self, url: str) -> httpx.Response:
+        """GET met negatieve cache: een 404 wordt NEGATIVE_TTL_S onthouden.
+        Raised niet op een foutstatus; de aanroeper kijkt naar `is_success` (geen exception per gemist pad)."""
+        r = await self._client.get(url)
+        if r.status_code == 404:
+            self._misses[url] = time.monotonic() + self.NEGATIVE_TTL_S
+        return r
 
     async def _get(self, path: str) -> Dict[str, Any]:
-        async with httpx.AsyncClient(timeout=self.timeout, headers=self._headers()) as client:
-            r = await client.get(f"{self.base_url}{path}")
-            r.raise_for_status()
-            return r.json()
+        async with self._sem:
+            r = await self._client.get(f"{self.base_url}{path}")
+        r.raise_for_status()
+        return json_loads(r.content)
 
     async def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        async with httpx.AsyncClient(timeout=self.timeout, headers=self._headers()) as client:
-            r = await client.post(f"{self.base_url}{path}", json=payload)
-            r.raise_for_status()
-            return r.json() if r.content else {}
+        async with self._sem:
+            r = await self._client.post(f"{self.base_url}{path}", json=payload)
+        r.raise_for_status()
+        return json_loads(r.content) if r.content else {}
 
     # ---- Leesdata (pas aan) ----
+    @ttl_cached(POLL_INTERVAL_S * 0.8)
     async def get_overview(self) -> Dict[str, Any]:
         """Try multiple common overview endpoints and accept JSON or simple text.
         Expected JSON example: {"soc": 72.5, "batt_power": -1200}
         """
         # Check if we should use integrated BLE instead
-        if MARSTEK_USE_BLE and BLE_AVAILABLE:
+        if self._use_ble:
             try:
                 ble_client = get_ble_client()
-                ble_data = await ble_client.get_battery_status()
+                ble_data = await _cached_ble("status", ble_client.get_battery_status)
                 
                 # Convert BLE response to expected format
                 return {
@@ -612,61 +1049,86 @@ class MarstekClient:
                 return {"error": f"BLE error: {e}", "source": "ble_integrated"}
         
         # Use direct network API (original implementation)
-        candidates = [
-            "/api/overview",
-            "/overview",
-            "/api/status",
-            "/status",
-            "/api",
-            "/",
-        ]
+        urls = self._overview_urls
+        if self._hit_url:
+            # Geleerd endpoint eerst; de kandidatenlijst is alleen nog fallback
+            urls = [self._hit_url] + [u for u in urls if u != self._hit_url]
         last_err: Optional[str] = None
-        for p in candidates:
+        for url in urls:
+            if self._known_miss(url):
+                continue
             try:
-                async with httpx.AsyncClient(timeout=self.timeout, headers=self._headers()) as client:
-                    r = await client.get(f"{self.base_url}{p}")
-                    r.raise_for_status()
-                    # Try JSON first
-                    try:
-                        data = r.json()
-                        return data
-                    except ValueError:
-                        # Accept simple key=value or plain text by wrapping
-                        text = r.text.strip()
-                        if text:
-                            return {"raw": text}
+                r = await self._fetch(url)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if url == self._hit_url:
+                    self._forget_hit()
+                # De base_url kandidaten delen host:poort; is die onbereikbaar, dan heeft verder proberen
+                # geen zin. Een geleerd endpoint op een andere poort (via probe) zegt niets over base_url.
+                if urlsplit(url).netloc == self._netloc:
+                    raise RuntimeError(str(e)) from e
+                last_err = str(e)
+                continue
             except Exception as e:
                 last_err = str(e)
                 continue
+            if not r.is_success:
+                if url == self._hit_url:
+                    self._forget_hit()
+                last_err = f"HTTP {r.status_code} voor {url}"
+                continue
+            # JSON op basis van content-type/eerste byte; platte tekst kost zo geen parse-exception
+            typ, data = sniff_body(r)
+            if typ == "json":
+                self._learn_hit(url)
+                self._json_only = True
+                return data
+            if self._json_only:
+                last_err = f"Geen JSON van {url}"
+                continue
+            # Accept simple key=value or plain text by wrapping
+            if data:
+                self._learn_hit(url)
+                return {"raw": data}
+        # Niets meer gevonden: volgende keer ook tekst weer accepteren
+        self._json_only = False
         raise RuntimeError(last_err or "No endpoints matched")
 
     # -------------------------
     # UDP JSON-RPC (per Open API)
     # -------------------------
+    def _udp_addr(self) -> Tuple[str, int]:
+        """UDP doel: host uit base_url, poort MARSTEK_UDP_PORT (default 30000)."""
+        return self._host, self._udp_port
+
     async def _udp_call(self, method: str, params: Optional[Dict[str, Any]] = None, timeout: float = 1.0) -> Dict[str, Any]:
         """Send a JSON-RPC message over UDP to the device. Host derived from base_url, port default 30000.
         Returns result dict or raises RuntimeError.
+        Non-blocking: wacht via de event loop op het antwoord, zodat meerdere calls tegelijk kunnen lopen.
         """
-        import socket, json as _json
-        # Derive host from base_url
-        try:
-            host = self.base_url.split("//", 1)[-1].split(":", 1)[0]
-        except Exception:
-            host = self.base_url
-        port = int(os.getenv("MARSTEK_UDP_PORT", "30000"))
+        host, port = self._udp_addr()
 
-        req = {"id": 1, "method": method, "params": {"id": 0} | (params or {})}
-        data = _json.dumps(req).encode("utf-8")
-
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            sock.settimeout(timeout)
-            sock.sendto(data, (host, port))
+        if params:
+            data = json_dumps({"id": 1, "method": method, "params": {"id": 0, **params}})
+        else:
+            # Zonder params is het verzoek per methode altijd hetzelfde: één keer serialiseren
+            data = _UDP_REQUESTS.get(method)
+            if data is None:
+                data = _UDP_REQUESTS[method] = json_dumps({"id": 1, "method": method, "params": {"id": 0}})
+
+        # Eigen endpoint (bronpoort) per call: het antwoord hoort altijd bij dit verzoek
+        loop = asyncio.get_running_loop()
+        fut: asyncio.Future = loop.create_future()
+        transport, _ = await loop.create_datagram_endpoint(lambda: _UdpRpcProtocol(fut), remote_addr=(host, port))
+        try:
+            transport.sendto(data)
             try:
-                buf, _ = sock.recvfrom(4096)
-            except socket.timeout:
+                buf = await asyncio.wait_for(fut, timeout)
+            except asyncio.TimeoutError:
                 raise RuntimeError(f"UDP timeout calling {method}")
+        finally:
+            transport.close()
         try:
-            resp = _json.loads(buf.decode("utf-8", errors="ignore"))
+            resp = json_loads(buf)
         except Exception as e:
             raise RuntimeError(f"UDP parse error: {e}")
         if "result" in resp:
@@ -698,65 +1160,74 @@ class MarstekClient:
         """Probe multiple ports and paths, return first working sample and the url.
         """
         ports = ports or [30000, 30001, 8080, 80]
-        paths = [
-            "/api/overview",
-            "/overview",
-            "/api/status",
-            "/status",
-            "/api",
-            "/",
-        ]
-        tried = []
-        base_host = self.base_url
+        paths = _SCAN_PATHS
         # Als base_url al een poort bevat, probeer eerst die
-        bases: list[str] = []
-        try:
-            # httpx kan geen urlparse hier, dus simpele check
-            has_port = ":" in base_host.rsplit("/", 1)[-1]
-        except Exception:
-            has_port = False
-        if has_port:
-            bases.append(base_host)
+        bases: list[str] = [self.base_url] if self._port is not None else []
         # Voeg combinaties met alternatieve poorten toe
+        bases += [f"{self._scheme}://{self._host}:{port}" for port in ports]
+
+        tried = [f"{b}{p}" for b in bases for p in paths if not self._known_miss(f"{b}{p}")]
+        sem = asyncio.Semaphore(8)
+
+        async def _try(url: str):
+            async with sem:
+                r = await self._fetch(url)
+            if not r.is_success:
+                return None
+            # Prefer JSON
+            typ, sample = sniff_body(r)
+            return url, (sample if typ == "json" else {"raw": r.text})
+
+        # Alle (base, pad) combinaties parallel, maar in kandidaat-volgorde afwachten: de eerste 2xx in
+        # de lijst wint (bv. /api/overview boven /), niet de snelste. Daarna wordt de rest geannuleerd.
+        tasks = [asyncio.create_task(_try(url)) for url in tried]
         try:
-            scheme, rest = base_host.split("://", 1)
-        except ValueError:
-            scheme, rest = "http", base_host
-        host = rest.split("/", 1)[0]
-        # Strip existing port if present
-        host_only = host.split(":", 1)[0]
-        for port in ports:
-            bases.append(f"{scheme}://{host_only}:{port}")
-
-        for b in bases:
-            for p in paths:
-                url = f"{b}{p}"
-                tried.append(url)
+            for task in tasks:
                 try:
-                    async with httpx.AsyncClient(timeout=self.timeout, headers=self._headers()) as client:
-                        r = await client.get(url)
-                        r.raise_for_status()
-                        # Prefer JSON
-                        try:
-                            sample = r.json()
-                        except ValueError:
-                            sample = {"raw": r.text}
-                        return {"ok": True, "hit": url, "sample": sample, "tried": tried}
+                    hit = await task
                 except Exception:
                     continue
+                if hit is None:
+                    continue
+                url, sample = hit
+                self._learn_hit(url)
+                return {"ok": True, "hit": url, "sample": sample, "tried": tried}
+        finally:
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
         return {"ok": False, "error": "All connection attempts failed", "tried": tried}
 
-    async def get_soc(self) -> Optional[float]:
+    @staticmethod
+    def soc_of(data: Dict[str, Any]) -> Optional[float]:
         try:
-            data = await self.get_overview()
             return float(data.get("soc")) if "soc" in data else None
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def power_of(data: Dict[str, Any]) -> Optional[int]:
+        try:
+            return int(data.get("batt_power")) if "batt_power" in data else None
+        except (TypeError, ValueError):
+            return None
+
+    async def get_status_bulk(self) -> "MarstekView":
+        """SoC en vermogen samen uit één overview round-trip (leeg MarstekView bij een fout)."""
+        try:
+            return parse_marstek(await self.get_overview())
+        except Exception:
+            return MarstekView()
+
+    async def get_soc(self) -> Optional[float]:
+        try:
+            return self.soc_of(await self.get_overview())
         except Exception:
             return None
 
     async def get_power(self) -> Optional[int]:
         try:
-            data = await self.get_overview()
-            return int(data.get("batt_power")) if "batt_power" in data else None
+            return self.power_of(await self.get_overview())
         except Exception:
             return None
 
@@ -764,6 +1235,7 @@ class MarstekClient:
     async def inhibit_charge(self) -> bool:
         try:
             await self._post("/api/control", {"charge": "off"})
+            invalidate_ttl_cache(self)
             return True
         except Exception:
             return False
@@ -771,6 +1243,7 @@ class MarstekClient:
     async def allow_charge(self) -> bool:
         try:
             await self._post("/api/control", {"charge": "on"})
+            invalidate_ttl_cache(self)
             return True
         except Exception:
             return False
@@ -778,469 +1251,733 @@ class MarstekClient:
 # =========================
 # Helpers voor parsing
 # =========================
+@dataclass(slots=True)
+class MyEnergiView:
+    """Afgeleide myenergi waarden, in één pass uit de status gehaald."""
+    grid_w: Optional[int] = None   # pos = export, neg = import
+    eddi_w: Optional[int] = None
+    zappi_w: Optional[int] = None
+    tank1: Optional[int] = None    # °C
+    tank2: Optional[int] = None    # °C
+    # Harvi CT clamps; telt niet mee in ==, zodat "niets veranderd" voor de regelaar
+    # niet op elke PV-fluctuatie breekt (beslissing hangt er niet van af)
+    pv_w: Optional[int] = field(default=None, compare=False)   # som "Generation" clamps, None als 0
+    ct_house_w: int = field(default=0, compare=False)          # som overige clamps (abs)
+    is_cloud: bool = field(default=False, compare=False)       # device-secties (cloud/hub), niet de oude platte vorm
+
+@dataclass(slots=True)
+class MarstekView:
+    """Getypeerde Marstek overview; None = onbekend of bron niet bereikbaar."""
+    soc: Optional[float] = None    # %
+    power_w: Optional[int] = None  # pos = laden, neg = ontladen
+
+def parse_marstek(overview: Any) -> MarstekView:
+    """Marstek overview (of Exception uit sample_all) naar een MarstekView."""
+    if not isinstance(overview, dict):
+        return MarstekView()
+    return MarstekView(MarstekClient.soc_of(overview), MarstekClient.power_of(overview))
+
+def _to_int(v: Any) -> Optional[int]:
+    """int-waarden direct doorgeven (myenergi levert al ints); alleen anders coercen."""
+    if type(v) is int or v is None:
+        return v
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+def _to_float(v: Any, default: Optional[float] = None) -> Optional[float]:
+    """float(v), of `default` als v ontbreekt of geen getal is."""
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return default
+
+_DEVICE_KINDS = ("zappi", "eddi", "harvi")
+# Harvi CT clamps 1..3: (vermogen, type) keys
+_CT_KEYS = tuple((f"ectp{i}", f"ectt{i}") for i in (1, 2, 3))
+
+def _devices_by_kind(raw: Any) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Eerste device-dict per type ({"zappi": {...}, ...}) uit een cloud response, of None.
+    Wildcard: lijst van secties [{"eddi":[...]}, {"zappi":[...]}]. Fallback per type (status_all):
+    {"zappi": <jstatus-Z antwoord>, ...} met dezelfde secties als waarden."""
+    if isinstance(raw, list):
+        sections = raw
+    elif isinstance(raw, dict) and any(kind in raw for kind in _DEVICE_KINDS):
+        sections = []
+        for part in raw.values():
+            if isinstance(part, dict):
+                sections.append(part)
+            elif isinstance(part, list):
+                sections.extend(part)
+    else:
+        return None
+    by_kind: Dict[str, Dict[str, Any]] = {}
+    for section in sections:
+        if not isinstance(section, dict):
+            continue
+        for kind, arr in section.items():
+            if kind not in by_kind and isinstance(arr, list) and arr and isinstance(arr[0], dict):
+                by_kind[kind] = arr[0]
+    return by_kind
+
+# Laatst geparste status (op identiteit): extractors en beslislogica delen zo één parse per tick
+_parsed_last: tuple[Any, Optional[MyEnergiView]] = (None, None)
+
+def parse_myenergi(myenergi_status: Dict[str, Any]) -> MyEnergiView:
+    """Loop één keer over de myenergi status en vul alle afgeleide velden."""
+    global _parsed_last
+    if _parsed_last[0] is myenergi_status:
+        return _parsed_last[1]
+
+    view = MyEnergiView()
+    raw = myenergi_status.get("raw", myenergi_status)
+    by_kind = _devices_by_kind(raw)
+    if by_kind is not None:
+        view.is_cloud = True
+        zappi = by_kind.get("zappi")
+        eddi = by_kind.get("eddi")
+        harvi = by_kind.get("harvi")
+        if zappi is not None:
+            # zappi[0]['div'] = delivered power, anders 'che' (charge added)
+            v = zappi.get("div")
+            if v is None:
+                v = zappi.get("che")
+            view.zappi_w = _to_int(v)
+        if eddi is not None:
+            # eddi[0]['ectp1'] (kanaal 1) of 'div' (delivered power)
+            v = eddi.get("ectp1")
+            if v is None:
+                v = eddi.get("div")
+            view.eddi_w = _to_int(v)
+            # Tank temperaturen: tp1, tp2 (al in hele graden, -1 = geen sensor)
+            t = eddi.get("tp1")
+            if t is not None and t != -1:
+                view.tank1 = _to_int(t)
+            t = eddi.get("tp2")
+            if t is not None and t != -1:
+                view.tank2 = _to_int(t)
+        # Grid (grd): al conventie pos = export, neg = import; zappi eerst, eddi als fallback
+        grd = zappi.get("grd") if zappi is not None else None
+        if grd is None and eddi is not None:
+            grd = eddi.get("grd")
+        view.grid_w = _to_int(grd)
+        if harvi is not None:
+            pv_w = ct_house_w = 0
+            for power_key, type_key in _CT_KEYS:
+                ct_type = harvi.get(type_key)
+                if ct_type is None and type_key not in harvi:
+                    continue
+                power = _to_int(harvi.get(power_key))
+                if power is None:
+                    continue
+                if ct_type == "Generation":
+                    pv_w += power
+                elif str(ct_type or "").lower() != "generation":
+                    # Niet-generation clamps = huisverbruik; abs tegen verkeerde CT-richting
+                    ct_house_w += abs(power)
+            view.pv_w = pv_w if pv_w > 0 else None
+            view.ct_house_w = ct_house_w
+    else:
+        # Oudere/lokale vorm: direct velden op het top-level object
+        items = raw if isinstance(raw, dict) else {}
+        if "pgrid" in items:
+            pgrid = _to_int(items["pgrid"])  # vaak: + = import, - = export
+            view.grid_w = -pgrid if pgrid is not None else None
+        v = items.get("ectp") or items.get("p")
+        view.eddi_w = _to_int(v) if v is not None else None
+        v = items.get("div") or items.get("che")
+        view.zappi_w = _to_int(v) if v is not None else None
+        if "tp1" in items and items["tp1"] != -1:
+            view.tank1 = _to_int(items["tp1"])
+        if "tp2" in items and items["tp2"] != -1:
+            view.tank2 = _to_int(items["tp2"])
+
+    _parsed_last = (myenergi_status, view)
+    return view
+
 def extract_grid_export_w(myenergi_status: Dict[str, Any]) -> Optional[int]:
     """Grid export/import uit myenergi halen (positief = export)."""
-    raw = myenergi_status.get("raw", myenergi_status)
-    try:
-        # Cloud response is lijst van secties: {"eddi":[...]} {"zappi":[...]}
-        if isinstance(raw, list):
-            # Probeer eerst zappi[0]['grd'] (grid power). Negatief = import, positief = export.
-            for section in raw:
-                if isinstance(section, dict) and "zappi" in section:
-                    arr = section.get("zappi") or []
-                    if arr and isinstance(arr[0], dict) and "grd" in arr[0]:
-                        grd = int(arr[0]["grd"])
-                        return grd  # hier is al conventie: pos = export, neg = import
-            # Fallback: eddi[0]['grd'] indien aanwezig
-            for section in raw:
-                if isinstance(section, dict) and "eddi" in section:
-                    arr = section.get("eddi") or []
-                    if arr and isinstance(arr[0], dict) and "grd" in arr[0]:
-                        grd = int(arr[0]["grd"])
-                        return grd
-        else:
-            # Oudere/lokale vorm: direct pgrid of status.pgrid
-            items = raw if isinstance(raw, dict) else {}
-            if "pgrid" in items:
-                pgrid = int(items["pgrid"])  # vaak: + = import, - = export
-                return -pgrid
-    except Exception:
-        pass
-    return None
+    return parse_myenergi(myenergi_status).grid_w
 
 def extract_eddi_power_w(myenergi_status: Dict[str, Any]) -> Optional[int]:
     """Eddi-vermogen (W)."""
-    raw = myenergi_status.get("raw", myenergi_status)
-    try:
-        if isinstance(raw, list):
-            # Cloud: eddi[0]['ectp1'] (of 'div' = delivered power) is een goede benadering.
-            for section in raw:
-                if isinstance(section, dict) and "eddi" in section:
-                    arr = section.get("eddi") or []
-                    if arr and isinstance(arr[0], dict):
-                        eddi = arr[0]
-                        if "ectp1" in eddi:
-                            return int(eddi["ectp1"])  # vermogen kanaal 1
-                        if "div" in eddi:
-                            return int(eddi["div"])    # delivered/imported power
-        else:
-            # Lokale/legacy: direct ectp of p
-            items = raw if isinstance(raw, dict) else {}
-            v = items.get("ectp") or items.get("p")
-            return int(v) if v is not None else None
-    except Exception:
-        pass
-    return None
+    return parse_myenergi(myenergi_status).eddi_w
 
 def extract_zappi_power_w(myenergi_status: Dict[str, Any]) -> Optional[int]:
     """Zappi-vermogen (W) - auto opladen."""
-    raw = myenergi_status.get("raw", myenergi_status)
-    try:
-        if isinstance(raw, list):
-            # Cloud: zappi[0]['div'] = delivered power
-            for section in raw:
-                if isinstance(section, dict) and "zappi" in section:
-                    arr = section.get("zappi") or []
-                    if arr and isinstance(arr[0], dict):
-                        zappi = arr[0]
-                        if "div" in zappi:
-                            return int(zappi["div"])    # delivered power
-                        if "che" in zappi:  # charge added
-                            return int(zappi["che"])
-        else:
-            # Lokale/legacy: direct div of che
-            items = raw if isinstance(raw, dict) else {}
-            v = items.get("div") or items.get("che")
-            return int(v) if v is not None else None
-    except Exception:
-        pass
-    return None
+    return parse_myenergi(myenergi_status).zappi_w
 
 def extract_house_consumption_w(myenergi_status: Dict[str, Any], battery_power_w: int = 0) -> Optional[int]:
     """Huis verbruik (W) - berekend uit CT clamps en devices."""
-    raw = myenergi_status.get("raw", myenergi_status)
-    try:
-        if isinstance(raw, list):
-            # Prefer CT consumption from Harvi if available
-            ct_consumption = 0
-            pv_generation = 0
-            
-            for section in raw:
-                if isinstance(section, dict) and "harvi" in section:
-                    arr = section.get("harvi") or []
-                    if arr and isinstance(arr[0], dict):
-                        harvi = arr[0]
-                        
-                        # CT clamps power (ectp1, ectp2, ectp3)
-                        for i in range(1, 4):
-                            ct_power_key = f"ectp{i}"
-                            ct_type_key = f"ectt{i}"
-                            
-                            if ct_power_key in harvi and ct_type_key in harvi:
-                                try:
-                                    power = int(harvi[ct_power_key])
-                                except Exception:
-                                    continue
-                                ct_type = str(harvi[ct_type_key] or "").lower()
-                                
-                                if ct_type == "generation":
-                                    pv_generation += power
-                                else:
-                                    # Treat non-generation clamps as house load; abs guards against sign config
-                                    ct_consumption += abs(power)
-            
-            # If we have CT-based house load, use it directly
-            if ct_consumption > 0:
-                logger.info(f"House consumption from CT clamps: {ct_consumption}W")
-                return ct_consumption
-            
-            # Fallback: derive from grid and device loads
-            eddi_w = extract_eddi_power_w(myenergi_status) or 0
-            zappi_w = extract_zappi_power_w(myenergi_status) or 0
-            grid_w = extract_grid_export_w(myenergi_status) or 0
-            pv_gen = extract_pv_generation_w(myenergi_status) or 0
-
-            # Huisverbruik = PV Generatie + Grid Import - Eddi Verbruik - Zappi Verbruik - Batterij Laden
-            # Let op: grid_w is positief bij import (vanuit huis perspectief), negatief bij export.
-            # Batterij laden is positief (verbruikt energie), ontladen is negatief (levert energie)
-            # De formule `pv_gen + grid_w` dekt dus zowel import als export correct.
-            # Voorbeeld Import: 0 (pv) + 2000 (grid import) - 0 - 0 - 500 (batterij laden) = 1500 (huis verbruik)
-            # Voorbeeld Export: 5000 (pv) + (-1000) (grid export) - 0 - 0 - 0 = 4000 (huis verbruik)
-            house_consumption = pv_gen + grid_w - eddi_w - zappi_w - battery_power_w
-            logger.info(f"House consumption fallback: pv={pv_gen}, grid={grid_w}, eddi={eddi_w}, zappi={zappi_w}, battery={battery_power_w} -> house={house_consumption}")
-            return max(0, int(house_consumption))
-                
-    except Exception:
-        pass
-    return None
+    view = parse_myenergi(myenergi_status)
+    if not view.is_cloud:
+        return None
+
+    # If we have CT-based house load (Harvi), use it directly
+    if view.ct_house_w > 0:
+        logger.info(f"House consumption from CT clamps: {view.ct_house_w}W")
+        return view.ct_house_w
+
+    # Fallback: derive from grid and device loads
+    eddi_w = view.eddi_w or 0
+    zappi_w = view.zappi_w or 0
+    grid_w = view.grid_w or 0
+    pv_gen = view.pv_w or 0
+    # Huisverbruik = PV Generatie + Grid Import - Eddi Verbruik - Zappi Verbruik - Batterij Laden
+    # Let op: grid_w is positief bij import (vanuit huis perspectief), negatief bij export.
+    # Batterij laden is positief (verbruikt energie), ontladen is negatief (levert energie)
+    # De formule `pv_gen + grid_w` dekt dus zowel import als export correct.
+    # Voorbeeld Import: 0 (pv) + 2000 (grid import) - 0 - 0 - 500 (batterij laden) = 1500 (huis verbruik)
+    # Voorbeeld Export: 5000 (pv) + (-1000) (grid export) - 0 - 0 - 0 = 4000 (huis verbruik)
+    house_consumption = pv_gen + grid_w - eddi_w - zappi_w - battery_power_w
+    logger.info(f"House consumption fallback: pv={pv_gen}, grid={grid_w}, eddi={eddi_w}, zappi={zappi_w}, battery={battery_power_w} -> house={house_consumption}")
+    return max(0, int(house_consumption))
 
 def extract_pv_generation_w(myenergi_status: Dict[str, Any]) -> Optional[int]:
     """PV generatie (W) - uit Harvi CT clamps."""
-    raw = myenergi_status.get("raw", myenergi_status)
-    try:
-        if isinstance(raw, list):
-            total_generation = 0
-            
-            for section in raw:
-                if isinstance(section, dict) and "harvi" in section:
-                    arr = section.get("harvi") or []
-                    if arr and isinstance(arr[0], dict):
-                        harvi = arr[0]
-                        
-                        # Look for Generation CT clamps
-                        for i in range(1, 4):
-                            ct_power_key = f"ectp{i}"
-                            ct_type_key = f"ectt{i}"
-                            
-                            if ct_power_key in harvi and ct_type_key in harvi:
-                                if harvi[ct_type_key] == "Generation":
-                                    total_generation += int(harvi[ct_power_key])
-            
-            return total_generation if total_generation > 0 else None
-                
-    except Exception:
-        pass
-    return None
+    return parse_myenergi(myenergi_status).pv_w
 
 def extract_eddi_temperatures(myenergi_status: Dict[str, Any]) -> Dict[str, Optional[int]]:
     """Eddi tank temperaturen (°C)."""
-    raw = myenergi_status.get("raw", myenergi_status)
-    temps = {"tank1": None, "tank2": None}
-    
-    try:
-        if isinstance(raw, list):
-            # Cloud response
-            for section in raw:
-                if isinstance(section, dict) and "eddi" in section:
-                    arr = section.get("eddi") or []
-                    if arr and isinstance(arr[0], dict):
-                        eddi = arr[0]
-                        # Tank temperaturen: tp1, tp2 (al in hele graden)
-                        if "tp1" in eddi and eddi["tp1"] != -1:
-                            temps["tank1"] = int(eddi["tp1"])
-                        if "tp2" in eddi and eddi["tp2"] != -1:
-                            temps["tank2"] = int(eddi["tp2"])
-        else:
-            # Lokale response
-            items = raw if isinstance(raw, dict) else {}
-            if "tp1" in items and items["tp1"] != -1:
-                temps["tank1"] = int(items["tp1"])
-            if "tp2" in items and items["tp2"] != -1:
-                temps["tank2"] = int(items["tp2"])
-                
-    except Exception:
-        pass
-    
-    return temps
+    view = parse_myenergi(myenergi_status)
+    return {"tank1": view.tank1, "tank2": view.tank2}
 
-def should_block_battery_for_priority(myenergi_status: Dict[str, Any], current_blocked: bool) -> tuple[bool, str]:
+def decide_block(view: MyEnergiView, current_blocked: bool) -> bool:
     """
-    Bepaal of batterij geblokkeerd moet worden voor myenergi prioriteit.
-    Prioriteit: Zappi > Eddi > Batterij
-    Returns: (should_block, reason)
+    Pure beslissing: moet de batterij geblokkeerd worden voor myenergi prioriteit?
+    Prioriteit: Zappi > Eddi > Batterij. Geen strings, geen side effects.
     """
-    eddi_power = extract_eddi_power_w(myenergi_status) or 0
-    zappi_power = extract_zappi_power_w(myenergi_status) or 0
-    export_w = extract_grid_export_w(myenergi_status) or 0
-    
     if EDDI_PRIORITY_MODE == "threshold":
-        # Smart threshold-based management met hysterese
-        
+        zappi_power = view.zappi_w or 0
+        # Hysterese + reserve als één comparator tegen een vooraf berekende drempel
+        return (zappi_power > ZAPPI_ACTIVE_W or
+                (view.grid_w or 0) < EXPORT_NEEDED_W[current_blocked, zappi_power > 0])
+    elif EDDI_PRIORITY_MODE == "power":
+        return (view.eddi_w or 0) > EDDI_ACTIVE_W
+    elif EDDI_PRIORITY_MODE == "temp":
+        return (
+            (EDDI_USE_TANK_1 and view.tank1 is not None and view.tank1 < EDDI_TARGET_TEMP_1) or
+            (EDDI_USE_TANK_2 and view.tank2 is not None and view.tank2 < EDDI_TARGET_TEMP_2)
+        )
+    return False
+
+def explain_block(view: MyEnergiView, current_blocked: bool, decision: bool) -> str:
+    """Leesbare reden bij een beslissing van decide_block (alleen nodig bij logging/status).
+    Per modus alleen de velden lezen die die modus gebruikt."""
+    if EDDI_PRIORITY_MODE == "threshold":
+        eddi_power = view.eddi_w or 0
+        zappi_power = view.zappi_w or 0
+        export_w = view.grid_w or 0
         # 1. Zappi heeft altijd voorrang (auto laden)
         if zappi_power > ZAPPI_ACTIVE_W:
-            return True, f"Zappi active: {zappi_power}W > {ZAPPI_ACTIVE_W}W (auto charging priority)"
-        
-        # 2. Bereken totale reserves (Zappi + Eddi)
-        total_reserve = EDDI_RESERVE_W
-        if zappi_power > 0:  # Zappi wil laden maar is niet actief genoeg
-            total_reserve += ZAPPI_RESERVE_W
-        
-        # 3. Hysterese om toggle te voorkomen
+            return f"Zappi active: {zappi_power}W > {ZAPPI_ACTIVE_W}W (auto charging priority)"
+        # 2. Hysterese om toggle te voorkomen
         if current_blocked:
             # Batterij is UIT → hogere drempel om AAN te gaan (anti-toggle)
-            min_export = BATTERY_MIN_EXPORT_W + BATTERY_HYSTERESIS_W
+            min_export = BATTERY_MIN_EXPORT_ON_W
             if export_w < min_export:
-                return True, f"Export {export_w}W < battery minimum+hysteresis {min_export}W"
+                return f"Export {export_w}W < battery minimum+hysteresis {min_export}W"
         else:
-            # Batterij is AAN → lagere drempel om UIT te gaan (anti-toggle)  
-            min_export = BATTERY_MIN_EXPORT_W - BATTERY_HYSTERESIS_W
+            # Batterij is AAN → lagere drempel om UIT te gaan (anti-toggle)
+            min_export = BATTERY_MIN_EXPORT_OFF_W
             if export_w < min_export:
-                return True, f"Export {export_w}W < battery minimum-hysteresis {min_export}W"
-        
-        # 4. Check reserves
+                return f"Export {export_w}W < battery minimum-hysteresis {min_export}W"
+        # 3. Reserves (Zappi + Eddi)
+        # Zappi wil laden maar is niet actief genoeg → ook Zappi reserve
+        total_reserve = EDDI_ZAPPI_RESERVE_W if zappi_power > 0 else EDDI_RESERVE_W
         if export_w < total_reserve:
             devices = ["Eddi"]
             if zappi_power > 0:
                 devices.insert(0, "Zappi")
-            return True, f"Export {export_w}W < {'+'.join(devices)} reserve {total_reserve}W"
-        
-        return False, f"Export {export_w}W sufficient (Zappi:{zappi_power}W, Eddi:{eddi_power}W)"
-    
+            return f"Export {export_w}W < {'+'.join(devices)} reserve {total_reserve}W"
+        return f"Export {export_w}W sufficient (Zappi:{zappi_power}W, Eddi:{eddi_power}W)"
+
     elif EDDI_PRIORITY_MODE == "power":
-        # Power-based: Eddi gebruikt stroom → batterij blokkeren
-        if eddi_power > EDDI_ACTIVE_W:
-            return True, f"Eddi active: {eddi_power}W > {EDDI_ACTIVE_W}W"
-        return False, f"Eddi idle: {eddi_power}W ≤ {EDDI_ACTIVE_W}W"
-    
+        eddi_power = view.eddi_w or 0
+        if decision:
+            return f"Eddi active: {eddi_power}W > {EDDI_ACTIVE_W}W"
+        return f"Eddi idle: {eddi_power}W ≤ {EDDI_ACTIVE_W}W"
+
     elif EDDI_PRIORITY_MODE == "temp":
-        # Temperature-based: Tank(s) niet op temperatuur → batterij blokkeren
-        temps = extract_eddi_temperatures(myenergi_status)
-        
         reasons = []
-        should_block = False
-        
-        if EDDI_USE_TANK_1 and temps["tank1"] is not None:
-            if temps["tank1"] < EDDI_TARGET_TEMP_1:
-                should_block = True
-                reasons.append(f"Tank1: {temps['tank1']}°C < {EDDI_TARGET_TEMP_1}°C")
+        if EDDI_USE_TANK_1 and view.tank1 is not None:
+            if view.tank1 < EDDI_TARGET_TEMP_1:
+                reasons.append(f"Tank1: {view.tank1}°C < {EDDI_TARGET_TEMP_1}°C")
             else:
-                reasons.append(f"Tank1: {temps['tank1']}°C ≥ {EDDI_TARGET_TEMP_1}°C")
-        
-        if EDDI_USE_TANK_2 and temps["tank2"] is not None:
-            if temps["tank2"] < EDDI_TARGET_TEMP_2:
-                should_block = True
-                reasons.append(f"Tank2: {temps['tank2']}°C < {EDDI_TARGET_TEMP_2}°C")
+                reasons.append(f"Tank1: {view.tank1}°C ≥ {EDDI_TARGET_TEMP_1}°C")
+        if EDDI_USE_TANK_2 and view.tank2 is not None:
+            if view.tank2 < EDDI_TARGET_TEMP_2:
+                reasons.append(f"Tank2: {view.tank2}°C < {EDDI_TARGET_TEMP_2}°C")
             else:
-                reasons.append(f"Tank2: {temps['tank2']}°C ≥ {EDDI_TARGET_TEMP_2}°C")
-        
+                reasons.append(f"Tank2: {view.tank2}°C ≥ {EDDI_TARGET_TEMP_2}°C")
         if not reasons:
-            return False, "No tank temperatures available"
-        
-        reason = "Eddi tanks: " + ", ".join(reasons)
-        return should_block, reason
-    
-    else:
-        return False, f"Unknown priority mode: {EDDI_PRIORITY_MODE}"
+            return "No tank temperatures available"
+        return "Eddi tanks: " + ", ".join(reasons)
+
+    return f"Unknown priority mode: {EDDI_PRIORITY_MODE}"
+
+@dataclass(slots=True)
+class Derived:
+    """Alles wat uit één myenergi status afgeleid wordt: view + beslissing (reden lazy)."""
+    status: Dict[str, Any]      # bron; identiteit + blocked vormen de cache key
+    blocked: bool               # battery_blocked waarmee beslist is
+    view: MyEnergiView
+    should_block: bool
+    _reason: Optional[str] = None
+
+    def reason(self) -> str:
+        if self._reason is None:
+            v = self.view
+            self._reason = _explain_cached(v.grid_w, v.eddi_w, v.zappi_w, v.tank1, v.tank2,
+                                           self.blocked, self.should_block, EDDI_PRIORITY_MODE)
+        return self._reason
+
+@functools.lru_cache(maxsize=128)
+def _explain_cached(grid_w: Optional[int], eddi_w: Optional[int], zappi_w: Optional[int],
+                    tank1: Optional[int], tank2: Optional[int], blocked: bool, decision: bool, mode: str) -> str:
+    """explain_block op de waarden waar de reden van afhangt: een nieuwe status met dezelfde
+    vermogens/temperaturen (alleen dat/tim anders) bouwt de f-strings niet opnieuw op.
+    `mode` zit in de key zodat een gewijzigde EDDI_PRIORITY_MODE nooit een oude reden oplevert."""
+    return explain_block(MyEnergiView(grid_w, eddi_w, zappi_w, tank1, tank2), blocked, decision)
+
+def build_derived(myenergi_status: Dict[str, Any], current_blocked: bool) -> Derived:
+    """Afgeleide snapshot per tick; control_loop en /api/status delen hem zolang de status hetzelfde is."""
+    prev = state.last_derived
+    if prev is not None and prev.status is myenergi_status and prev.blocked == current_blocked:
+        return prev
+    view = parse_myenergi(myenergi_status)
+    derived = Derived(myenergi_status, current_blocked, view, decide_block(view, current_blocked))
+    state.last_derived = derived
+    return derived
+
+def block_decision(myenergi_status: Dict[str, Any], current_blocked: bool) -> tuple[bool, Callable[[], str]]:
+    """Beslissing + lazy reden: de reden-string wordt pas opgebouwd als reason() aangeroepen wordt."""
+    derived = build_derived(myenergi_status, current_blocked)
+    return derived.should_block, derived.reason
+
+def should_block_battery_for_priority(myenergi_status: Dict[str, Any], current_blocked: bool) -> tuple[bool, str]:
+    """
+    Bepaal of batterij geblokkeerd moet worden voor myenergi prioriteit.
+    Prioriteit: Zappi > Eddi > Batterij
+    Returns: (should_block, reason)
+    """
+    block, reason = block_decision(myenergi_status, current_blocked)
+    return block, reason()
 
 # =========================
 # Regelaartje (state machine)
 # =========================
 class ControllerState:
+    # Timers (last_switch, export_over_threshold_since) gebruiken time.monotonic():
+    # een NTP/DST sprong in de wandklok mag de cooldown niet resetten of overslaan.
+    # last_switch_wall is alleen voor weergave in /api/status.
+    # last_eval: (MyEnergiView, soc, battery_blocked, monotonic) van de laatste volledige evaluatie
+    __slots__ = ("battery_blocked", "last_switch", "last_switch_wall", "export_over_threshold_since", "last_eval",
+                 "last_derived")
+
     def __init__(self):
         self.battery_blocked: bool = False
-        self.last_switch: float = 0.0
+        self.last_switch: float = float("-inf")
+        self.last_switch_wall: float = 0.0
         self.export_over_threshold_since: Optional[float] = None
+        self.last_eval: Optional[tuple] = None
+        self.last_derived: Optional[Derived] = None
 
-    def cooldown_ok(self) -> bool:
-        return (time.time() - self.last_switch) > MIN_SWITCH_COOLDOWN_S
+    def cooldown_ok(self, now: Optional[float] = None) -> bool:
+        """Cooldown sinds de laatste switch voorbij? `now` (monotonic) van de lopende tick scheelt een klok-call."""
+        return ((time.monotonic() if now is None else now) - self.last_switch) > MIN_SWITCH_COOLDOWN_S
 
     def mark_switch(self):
-        self.last_switch = time.time()
+        self.last_switch = time.monotonic()
+        self.last_switch_wall = time.time()
+
+    def unchanged_since_last_eval(self, view: MyEnergiView, soc: Optional[float], now: float) -> bool:
+        """Zelfde input als de vorige evaluatie en geen timer-grens (cooldown, stabiele export) gepasseerd?
+        Vergelijkt de afgeleide waarden i.p.v. de ruwe status: die verandert elke tick (dat/tim velden)
+        terwijl vermogen en temperaturen vaak gelijk blijven."""
+        if self.last_eval is None:
+            return False
+        prev_view, prev_soc, prev_blocked, prev_t = self.last_eval
+        if prev_view != view or prev_soc != soc or prev_blocked != self.battery_blocked:
+            return False
+        deadlines = [self.last_switch + MIN_SWITCH_COOLDOWN_S]
+        if self.export_over_threshold_since is not None:
+            deadlines.append(self.export_over_threshold_since + STABLE_EXPORT_SECONDS)
+        return not any(prev_t <= d <= now for d in deadlines)
 
 state = ControllerState()
 
+def adaptive_poll_interval(export_w: Optional[int], eddi_w: Optional[int], prev_export_w: Optional[int]) -> float:
+    """
+    Poll-interval op basis van afstand tot de schakeldrempel van de actieve modus.
+    Dicht bij de drempel (of bij een sprong in export) → POLL_INTERVAL_S,
+    stabiel en ver van de drempel → oplopend tot POLL_INTERVAL_MAX_S.
+    """
+    if export_w is None:
+        return POLL_INTERVAL_S
+    if prev_export_w is not None and abs(export_w - prev_export_w) > EXPORT_ENOUGH_W:
+        return POLL_INTERVAL_S
+    if EDDI_PRIORITY_MODE == "power" and eddi_w is not None:
+        margin = abs(eddi_w - EDDI_ACTIVE_W)
+    else:
+        margin = abs(export_w - BATTERY_MIN_EXPORT_W)
+    interval = POLL_INTERVAL_S * (1 + margin / 500)
+    return min(max(interval, POLL_INTERVAL_S), POLL_INTERVAL_MAX_S)
+
 # =========================
 # FastAPI app
 # =========================
 from fastapi.staticfiles import StaticFiles
-app = FastAPI(title="myenergi-marstek-autocontrol")
+class ApiCORSMiddleware(CORSMiddleware):
+    """CORS alleen voor /api routes; de HTML pagina's zijn same-origin en slaan de CORS-afhandeling over."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+@functools.lru_cache(maxsize=64)
+def accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    """True als `coding` (of '*') in de Accept-Encoding header staat met q > 0; 'gzip;q=0' betekent juist: niet sturen."""
+    star = False
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        name = name.strip()
+        if name != coding and name != "*":
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name == coding:
+            return q > 0  # expliciete vermelding gaat voor '*'
+        star = q > 0
+    return star
+
+class AcceptGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware die q-waarden respecteert: bij 'gzip;q=0' gaat het antwoord ongecomprimeerd door.
+    Ook verzoeken om een NDJSON stream (Accept: application/x-ndjson, zie /api/marstek/scan) worden
+    niet gecomprimeerd: GZipMiddleware flusht niet per chunk, dan komen alle regels pas aan het eind."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = dict(scope["headers"])
+            accept = headers.get(b"accept-encoding", b"").decode("latin-1")
+            if not accepts_encoding(accept, "gzip") or b"application/x-ndjson" in headers.get(b"accept", b""):
+                await self.app(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
+
+# orjson (indien beschikbaar) voor alle JSON endpoints: dashboard pollt o.a. /api/status en /api/battery/status
+app = FastAPI(title="myenergi-marstek-autocontrol", default_response_class=FastJSONResponse)
 app.add_middleware(
-    CORSMiddleware,
+    ApiCORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Dynamische antwoorden (/api/status met myenergi_raw, scan resultaten) gecomprimeerd over de lijn.
+# Level 6: het dashboard pollt elke paar seconden, level 9 kost veel meer CPU voor nauwelijks minder bytes.
+# Vaste pagina's en /static leveren zelf een voorgecomprimeerde variant (Content-Encoding gezet → doorgelaten).
+GZIP_MIN_SIZE = 512
+app.add_middleware(AcceptGZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=6)
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles met Cache-Control en gecomprimeerde varianten.
+    Een .br/.gz naast het origineel (uit een build-stap) wordt alleen geserveerd als die niet ouder is dan
+    het origineel. Anders wordt de gzip variant bij de eerste aanvraag in het geheugen gemaakt en per
+    (mtime, grootte) hergebruikt; er wordt niets naar de (bron/external) mappen geschreven."""
+    COMPRESSIBLE = (".js", ".css", ".html", ".json", ".svg")
+    HASHED_ASSET = re.compile(r"\.[0-9a-f]{8,}\.\w+$")
+    VERSIONED_QUERY = re.compile(rb"(?:^|&)v=[0-9a-f]{8,}(?:&|$)")  # ?v=<content hash>, zie asset_version()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # pad -> (st_mtime_ns, st_size, gzip bytes, etag)
+        self._gz_cache: Dict[str, Tuple[int, int, bytes, str]] = {}
+
+    def _gzip_response(self, path: str, stat_result: os.stat_result, scope, status_code: int) -> Optional[Response]:
+        """In-memory gzip variant van `path`; None bij een leesfout of als comprimeren niets oplevert."""
+        cached = self._gz_cache.get(path)
+        if cached is None or cached[:2] != (stat_result.st_mtime_ns, stat_result.st_size):
+            try:
+                with open(path, "rb") as f:
+                    body = f.read()
+            except OSError:
+                return None
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) >= len(body):
+                return None
+            etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}-gz"'
+            cached = self._gz_cache[path] = (stat_result.st_mtime_ns, stat_result.st_size, gz, etag)
+        response = Response(cached[2], status_code=status_code, media_type=self._media_type(path), headers={
+            "ETag": cached[3],
+            "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "Content-Encoding": "gzip",
+        })
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    @staticmethod
+    def _media_type(path: str) -> str:
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if media_type.startswith("text/"):
+            media_type += "; charset=utf-8"
+        return media_type
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        path = str(full_path)
+        response = None
+        if path.endswith(self.COMPRESSIBLE):
+            accept = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"accept-encoding"), "")
+            for encoding, ext in (("br", ".br"), ("gzip", ".gz")):
+                if not accepts_encoding(accept, encoding):
+                    continue
+                try:
+                    compressed_stat = os.stat(path + ext)
+                except OSError:
+                    continue
+                if compressed_stat.st_mtime < stat_result.st_mtime:
+                    continue  # verouderd: origineel is na de build-stap aangepast
+                response = super().file_response(path + ext, compressed_stat, scope, status_code)
+                response.headers["Content-Type"] = self._media_type(path)
+                response.headers["Content-Encoding"] = encoding
+                break
+            if response is None and stat_result.st_size >= GZIP_MIN_SIZE and accepts_encoding(accept, "gzip"):
+                response = self._gzip_response(path, stat_result, scope, status_code)
+        if response is None:
+            response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Vary"] = "Accept-Encoding"
+        if self.HASHED_ASSET.search(path) or self.VERSIONED_QUERY.search(scope.get("query_string", b"")):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "public, max-age=300"
+        return response
 
 # Serve de lokale BLE tool (geclonede repo) op /ble
 try:
-    app.mount("/ble", StaticFiles(directory="external/marstek-venus-monitor", html=True), name="ble")
+    app.mount("/ble", PrecompressedStaticFiles(directory="external/marstek-venus-monitor", html=True), name="ble")
 except Exception:
     # Niet fataal als map ontbreekt
     pass
 
+# Eigen CSS/JS van de pagina's op /static; pagina's verwijzen met ?v=<hash>, dus de browser mag ze eeuwig cachen
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+try:
+    app.mount("/static", PrecompressedStaticFiles(directory=STATIC_DIR), name="static")
+except Exception:
+    pass
+
+def asset_version(name: str) -> str:
+    """Korte content-hash van static/<name> voor cache-busting; leeg als het bestand ontbreekt."""
+    try:
+        with open(os.path.join(STATIC_DIR, name), "rb") as f:
+            return hashlib.blake2b(f.read(), digest_size=6).hexdigest()
+    except OSError:
+        return ""
+
+# HTML pagina's staan in templates/; ze worden bij import één keer gerenderd (zie StaticPage hieronder)
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+templates = Jinja2Templates(directory=TEMPLATES_DIR)
+templates.env.auto_reload = False  # geen mtime-check per get_template
+
+def _render(name: str, **context: Any) -> str:
+    return templates.get_template(name).render(**context)
+
+class StaticPage:
+    """Vooraf gerenderde HTML (of ander vast antwoord) als bytes + ETag; een conditionele GET krijgt 304 zonder body.
+    Vanaf GZIP_MIN_SIZE ook een eenmalig gecomprimeerde gzip variant met eigen ETag, zodat GZipMiddleware
+    dezelfde bytes niet per hit opnieuw comprimeert."""
+    __slots__ = ("body", "etag", "headers", "full_headers", "ok", "not_modified",
+                 "gz_etag", "gz_ok", "gz_not_modified")
+
+    def __init__(self, html: "str | bytes", max_age: int = 300, media_type: str = "text/html; charset=utf-8"):
+        self.body = html.encode("utf-8") if isinstance(html, str) else html
+        self.etag = '"' + hashlib.blake2b(self.body, digest_size=8).hexdigest() + '"'
+        self.headers = {"ETag": self.etag, "Cache-Control": f"public, max-age={max_age}"}
+        gz = gzip.compress(self.body, compresslevel=9, mtime=0) if len(self.body) >= GZIP_MIN_SIZE else None
+        if gz is not None and len(gz) < len(self.body):
+            self.headers["Vary"] = "Accept-Encoding"
+            self.gz_etag = self.etag[:-1] + '-gz"'
+            gz_headers = {**self.headers, "ETag": self.gz_etag}
+            self.gz_ok = Response(gz, headers={**gz_headers, "Content-Type": media_type, "Content-Encoding": "gzip"})
+            self.gz_not_modified = Response(status_code=304, headers=gz_headers)
+        else:
+            self.gz_etag = self.gz_ok = self.gz_not_modified = None
+        # Content-Type staat al vast; Response hoeft per hit niets meer samen te stellen
+        self.full_headers = {**self.headers, "Content-Type": media_type}
+        # Beide antwoorden zijn onveranderlijk (body + raw headers al geëncodeerd) en worden per
+        # hit hergebruikt; Response.__call__ leest ze alleen
+        self.ok = Response(self.body, headers=self.full_headers)
+        self.not_modified = Response(status_code=304, headers=self.headers)
+
+    def response(self, request: Request) -> Response:
+        if self.gz_ok is not None and accepts_encoding(request.headers.get("accept-encoding", ""), "gzip"):
+            if request.headers.get("if-none-match") == self.gz_etag:
+                return self.gz_not_modified
+            return self.gz_ok
+        if request.headers.get("if-none-match") == self.etag:
+            return self.not_modified
+        return self.ok
+
+class FilePage:
+    """HTML-bestand op disk als StaticPage; alleen opnieuw inlezen als de mtime verandert.
+    De mtime wordt hooguit eens per `check_interval` seconden gecontroleerd (stat in de event loop)."""
+    __slots__ = ("path", "mtime", "page", "checked", "check_interval")
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.mtime: Optional[int] = None
+        self.page: Optional[StaticPage] = None
+        self.checked = float("-inf")
+        self.check_interval = check_interval
+
+    def get(self) -> StaticPage:
+        """Raises OSError als het bestand (nog) niet bestaat."""
+        now = time.monotonic()
+        if self.page is not None and now - self.checked < self.check_interval:
+            return self.page
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self.mtime or self.page is None:
+            with open(self.path, "rb") as f:
+                self.page = StaticPage(f.read())
+            self.mtime = mtime
+        self.checked = now
+        return self.page
+
+# Pagina's hangen niet van request-data af, dus één keer renderen. Het dashboard is volledig
+# statisch (zelfde ETag over herstarts heen); het poll-interval haalt het op via /api/config.json.
+_BLE_PAGE = StaticPage(_render("ble_set_meter_ip.html"))
+_INDEX_PAGE = StaticPage(_render("index.html"))
+_CONFIG_JSON = StaticPage(json_dumps({"pollMs": int(POLL_INTERVAL_S * 1000)}), media_type="application/json")
+_SETUP_PAGE = StaticPage(_render(
+    "setup.html",
+    default_ports=",".join(map(str, _DEFAULT_SCAN_PORTS)),
+    asset_v={name: asset_version(name) for name in ("setup.css", "setup.js")},
+))
+
 # Serve explicit BLE v1 (original) as its own endpoint so you can click a link
-from pathlib import Path
+_BLE_LEGACY_PAGE = FilePage("external/marstek-venus-monitor/index.html.original")
 
-@app.get("/ble-legacy")
-async def ble_legacy():
+# HTML-pagina's als kale Starlette routes: geen dependency-resolutie/response-model per hit
+# en niet in de OpenAPI schema. Ze geven alleen een vooraf gebouwde Response terug.
+async def ble_legacy(request: Request):
     try:
-        p = Path("external/marstek-venus-monitor/index.html.original")
-        return HTMLResponse(p.read_text(encoding="utf-8"))
-    except Exception as e:
+        return _BLE_LEGACY_PAGE.get().response(request)
+    except OSError as e:
         return HTMLResponse(f"<pre>BLE v1 not found: {e}</pre>", status_code=500)
 
-@app.get("/ble/set-meter-ip")
-async def ble_set_meter_ip_page():
-    html = """
-    <!doctype html>
-    <html lang=\"nl\">
-    <head>
-      <meta charset=\"utf-8\" />
-      <meta name=\"viewport\" content=\"width=device-width, initial-scale=1\" />
-      <title>BLE: Set Meter IP</title>
-      <style>
-        body { font-family: -apple-system, system-ui, Segoe UI, Roboto, Helvetica, Arial, sans-serif; margin: 2rem; background: #0f172a; color: #e2e8f0; }
-        .card { background:#111827; border:1px solid #374151; border-radius:12px; padding:16px; margin:12px 0; }
-        label { display:block; margin-top:8px; color:#cbd5e1; }
-        input { width:100%; padding:8px; border-radius:8px; border:1px solid #334155; background:#0b1220; color:#e2e8f0; }
-        button { background:#2563eb; color:#fff; border:0; padding:8px 12px; border-radius:8px; cursor:pointer; margin-top:12px; }
-        .row { display:flex; gap:12px; flex-wrap:wrap; }
-        pre { white-space:pre-wrap; word-break:break-word; background:#0b1220; padding:12px; border-radius:8px; border:1px solid #1f2937; }
-      </style>
-    </head>
-    <body>
-      <h1>BLE: Set Meter IP (0x21)</h1>
-      <div class=\"card\">
-        <div class=\"row\">
-          <button onclick=\"connect()\">🔗 Connect (select MST_ACCP_...)</button>
-          <button onclick=\"disconnect()\">Disconnect</button>
-        </div>
-        <label>Meter IP</label>
-        <input id=\"meter_ip\" placeholder=\"192.168.68.73\" value=\"192.168.68.73\" />
-        <div class=\"row\">
-          <button onclick=\"writeIP()\">🌐 Write Meter IP (0x21, 0x0A)</button>
-          <button onclick=\"readIP()\">📖 Read Meter IP (0x21, 0x0B)</button>
-        </div>
-        <div id=\"msg\"></div>
-        <pre id=\"log\"></pre>
-      </div>
-
-      <script src=\"/ble/js/ui-controller.js\"></script>
-      <script src=\"/ble/js/ble-protocol.js\"></script>
-      <script>
-        function logAppend(s){ const el = document.getElementById('log'); el.textContent += s + "\n"; el.scrollTop = el.scrollHeight; }
-        async function writeIP(){
-          const ip = document.getElementById('meter_ip').value.trim();
-          if(!ip){ document.getElementById('msg').textContent='Vul IP in'; return; }
-          const ok = /^\d{1,3}(\.\d{1,3}){3}$/.test(ip);
-          if(!ok){ document.getElementById('msg').textContent='Ongeldig IP'; return; }
-          const ascii = Array.from(new TextEncoder().encode(ip));
-          const payload = [0x0A, ...ascii];
-          try{ await sendCommand(0x21, 'Write Custom Meter IP', payload); document.getElementById('msg').textContent='Geschreven'; }
-          catch(e){ document.getElementById('msg').textContent='Fout: '+e; }
-        }
-        async function readIP(){
-          try{ await sendCommand(0x21, 'Read Meter IP', [0x0B]); document.getElementById('msg').textContent='Gelezen (zie log in UI)'; }
-          catch(e){ document.getElementById('msg').textContent='Fout: '+e; }
-        }
-      </script>
-    </body>
-    </html>
-    """
-    return HTMLResponse(html)
-
-@app.get("/ble-set-meter-ip")
-async def ble_set_meter_ip_page2():
-    # Same page, different route outside /ble to avoid static mount shadowing
-    html = """
-    <!doctype html>
-    <html lang=\"nl\">
-    <head>
-      <meta charset=\"utf-8\" />
-      <meta name=\"viewport\" content=\"width=device-width, initial-scale=1\" />
-      <title>BLE: Set Meter IP</title>
-      <style>
-        body { font-family: -apple-system, system-ui, Segoe UI, Roboto, Helvetica, Arial, sans-serif; margin: 2rem; background: #0f172a; color: #e2e8f0; }
-        .card { background:#111827; border:1px solid #374151; border-radius:12px; padding:16px; margin:12px 0; }
-        label { display:block; margin-top:8px; color:#cbd5e1; }
-        input { width:100%; padding:8px; border-radius:8px; border:1px solid #334155; background:#0b1220; color:#e2e8f0; }
-        button { background:#2563eb; color:#fff; border:0; padding:8px 12px; border-radius:8px; cursor:pointer; margin-top:12px; }
-        .row { display:flex; gap:12px; flex-wrap:wrap; }
-        pre { white-space:pre-wrap; word-break:break-word; background:#0b1220; padding:12px; border-radius:8px; border:1px solid #1f2937; }
-      </style>
-    </head>
-    <body>
-      <h1>BLE: Set Meter IP (0x21)</h1>
-      <div class=\"card\">
-        <div class=\"row\">
-          <button onclick=\"connect()\">🔗 Connect (select MST_ACCP_...)</button>
-          <button onclick=\"disconnect()\">Disconnect</button>
-        </div>
-        <label>Meter IP</label>
-        <input id=\"meter_ip\" placeholder=\"192.168.68.73\" value=\"192.168.68.73\" />
-        <div class=\"row\">
-          <button onclick=\"writeIP()\">🌐 Write Meter IP (0x21, 0x0A)</button>
-          <button onclick=\"readIP()\">📖 Read Meter IP (0x21, 0x0B)</button>
-        </div>
-        <div id=\"msg\"></div>
-        <pre id=\"log\"></pre>
-      </div>
-
-      <script src=\"/ble/js/ui-controller.js\"></script>
-      <script src=\"/ble/js/ble-protocol.js\"></script>
-      <script>
-        function logAppend(s){ const el = document.getElementById('log'); el.textContent += s + "\n"; el.scrollTop = el.scrollHeight; }
-        async function writeIP(){
-          const ip = document.getElementById('meter_ip').value.trim();
-          if(!ip){ document.getElementById('msg').textContent='Vul IP in'; return; }
-          const ok = /^\d{1,3}(\.\d{1,3}){3}$/.test(ip);
-          if(!ok){ document.getElementById('msg').textContent='Ongeldig IP'; return; }
-          const ascii = Array.from(new TextEncoder().encode(ip));
-          const payload = [0x0A, ...ascii];
-          try{ await sendCommand(0x21, 'Write Custom Meter IP', payload); document.getElementById('msg').textContent='Geschreven'; }
-          catch(e){ document.getElementById('msg').textContent='Fout: '+e; }
-        }
-        async function readIP(){
-          try{ await sendCommand(0x21, 'Read Meter IP', [0x0B]); document.getElementById('msg').textContent='Gelezen (zie log in UI)'; }
-          catch(e){ document.getElementById('msg').textContent='Fout: '+e; }
-        }
-      </script>
-    </body>
-    </html>
-    """
-    return HTMLResponse(html)
+app.add_route("/ble-legacy", ble_legacy, methods=["GET"], include_in_schema=False)
+
+async def ble_set_meter_ip_page(request: Request):
+    return _BLE_PAGE.response(request)
+
+# Same page, also outside /ble to avoid static mount shadowing
+app.add_route("/ble/set-meter-ip", ble_set_meter_ip_page, methods=["GET"], include_in_schema=False)
+app.add_route("/ble-set-meter-ip", ble_set_meter_ip_page, methods=["GET"], include_in_schema=False)
 
 myenergi = MyEnergiClient(MYENERGI_BASE_URL, MYENERGI_HUB_SERIAL, MYENERGI_API_KEY)
 marstek  = MarstekClient(MARSTEK_BASE_URL, MARSTEK_API_TOKEN)
 
+async def sample_all(marstek_timeout: float = 2.0) -> List[Any]:
+    """myenergi en Marstek tegelijk ophalen: een tick duurt max(t_my, t_marstek) i.p.v. de som.
+    Geeft [myenergi_status, marstek_overview]; een mislukte bron komt terug als Exception.
+    """
+    async def _myenergi():
+        async with myenergi_lock:
+            return await myenergi.status_all()
+
+    results = await asyncio.gather(
+        _myenergi(),
+        asyncio.wait_for(marstek.get_overview(), timeout=marstek_timeout),
+        return_exceptions=True,
+    )
+    # gather geeft ook de CancelledError van een geannuleerde (gedeelde) fetch terug; voor de aanroeper
+    # is dat gewoon een mislukte bron. Annulering van de aanroeper zelf komt hier niet: die raised gather.
+    return [RuntimeError(f"fetch cancelled: {r!r}") if isinstance(r, asyncio.CancelledError) else r
+            for r in results]
+
 @app.get("/health")
 async def health():
     return {"ok": True}
 
-@app.get("/api/status")
+@app.get("/api/config.json")
+async def frontend_config(request: Request):
+    """Vaste frontend-instellingen (poll-interval) voor het dashboard."""
+    return _CONFIG_JSON.response(request)
+
+# Live status: niet cachen in browsers/proxies
+_NO_STORE_HEADERS = {
+    "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
+    "Pragma": "no-cache",
+    "Expires": "0",
+}
+
+# Vaste config-sectie van /api/status (env, één keer bij import)
+_STATUS_CONFIG = {
+    "priority_mode": EDDI_PRIORITY_MODE,
+    "target_temp_1": EDDI_TARGET_TEMP_1,
+    "target_temp_2": EDDI_TARGET_TEMP_2,
+    "use_tank_1": EDDI_USE_TANK_1,
+    "use_tank_2": EDDI_USE_TANK_2,
+    "active_threshold_w": EDDI_ACTIVE_W,
+    "marstek_use_ble": MARSTEK_USE_BLE
+}
+
+class LatestStatus:
+    """Laatst geserialiseerde /api/status body. Bronnen komen uit de TTL-caches (zelfde object zolang
+    er niets nieuws is), dus meerdere dashboards binnen één poll krijgen dezelfde bytes terug.
+    Bewaard wordt alles behalve "timestamp"; die wordt per response vooraan gezet en klopt dus altijd."""
+    __slots__ = ("key", "rest")
+
+    def __init__(self):
+        self.key: Optional[tuple] = None
+        self.rest: bytes = b""  # geserialiseerde body zonder timestamp en zonder de openende "{"
+
+    def get(self, m: Any, overview: Any) -> Optional[bytes]:
+        key = self.key
+        if (key is not None and key[0] is m and key[1] is overview
+                and key[2] == state.battery_blocked and key[3] == state.last_switch_wall):
+            return self.rest
+        return None
+
+    def put(self, m: Any, overview: Any, content: Dict[str, Any]) -> bytes:
+        self.key = (m, overview, state.battery_blocked, state.last_switch_wall)
+        self.rest = json_dumps(content)[1:]
+        return self.rest
+
+    @staticmethod
+    def response(rest: bytes) -> Response:
+        body = b'{"timestamp":' + json_dumps(time.time()) + b"," + rest
+        return Response(body, media_type="application/json", headers=_NO_STORE_HEADERS)
+
+latest_status = LatestStatus()
+
+@app.get("/api/status", response_class=FastJSONResponse)
 async def get_status():
     """Samengevoegde status van myenergi + marstek."""
     try:
-        # myenergi data (always try this first)
-        async with myenergi_lock:
-            m = await myenergi.status_all()
-        export_w = extract_grid_export_w(m)
-        eddi_w = extract_eddi_power_w(m)
-        zappi_w = extract_zappi_power_w(m)
-        pv_w = extract_pv_generation_w(m)
-        eddi_temps = extract_eddi_temperatures(m)
-        should_block, block_reason = should_block_battery_for_priority(m, state.battery_blocked)
+        # myenergi + Marstek tegelijk; myenergi fout -> error payload hieronder
+        m, overview = await sample_all(marstek_timeout=2.0)
+        if isinstance(m, Exception):
+            raise m
+        # Zelfde bronnen en regelaar-state: vorige body hergebruiken, alleen "timestamp" is nieuw
+        rest = latest_status.get(m, overview)
+        if rest is not None:
+            return LatestStatus.response(rest)
+        derived = build_derived(m, state.battery_blocked)
+        view = derived.view
+        export_w, eddi_w, zappi_w, pv_w = view.grid_w, view.eddi_w, view.zappi_w, view.pv_w
+        eddi_temps = {"tank1": view.tank1, "tank2": view.tank2}
+        should_block, block_reason = derived.should_block, derived.reason()
         
         # Marstek data (with timeout protection)
         soc = None
@@ -1248,25 +1985,22 @@ async def get_status():
         marstek_error = None
         battery_power_w = 0
         
-        try:
-            # Try to get battery data with short timeout
-            import asyncio
-            soc = await asyncio.wait_for(marstek.get_soc(), timeout=2.0)
-            power = await asyncio.wait_for(marstek.get_power(), timeout=2.0)
+        if isinstance(overview, asyncio.TimeoutError):
+            marstek_error = "Battery connection timeout"
+        elif isinstance(overview, BaseException):
+            marstek_error = f"Battery error: {str(overview)[:50]}"
+        else:
+            battery = parse_marstek(overview)
+            soc, power = battery.soc, battery.power_w
             
             # Extract battery power for house consumption calculation
-            if power and hasattr(power, 'value'):
-                battery_power_w = int(power.value)  # Positive = charging (consuming), Negative = discharging (providing)
-        except asyncio.TimeoutError:
-            marstek_error = "Battery connection timeout"
-        except Exception as e:
-            marstek_error = f"Battery error: {str(e)[:50]}"
+            if power is not None:
+                battery_power_w = power  # Positive = charging (consuming), Negative = discharging (providing)
         
         # Calculate house consumption with battery power included
         house_w = extract_house_consumption_w(m, battery_power_w)
         
-        return {
-            "timestamp": time.time(),
+        rest = latest_status.put(m, overview, {
             "myenergi_raw": m,
             "grid_export_w": export_w,
             "eddi_power_w": eddi_w,
@@ -1280,293 +2014,64 @@ async def get_status():
             "marstek_power_w": power,
             "marstek_error": marstek_error,
             "battery_blocked": state.battery_blocked,
-            "last_switch": state.last_switch,
-            "config": {
-                "priority_mode": EDDI_PRIORITY_MODE,
-                "target_temp_1": EDDI_TARGET_TEMP_1,
-                "target_temp_2": EDDI_TARGET_TEMP_2,
-                "use_tank_1": EDDI_USE_TANK_1,
-                "use_tank_2": EDDI_USE_TANK_2,
-                "active_threshold_w": EDDI_ACTIVE_W,
-                "marstek_use_ble": MARSTEK_USE_BLE
-            }
-        }
-        # no-store headers to prevent caching in browsers/proxies
-        cache_headers = {
-            "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        }
-        return JSONResponse(content=payload, headers=cache_headers)
+            "last_switch": state.last_switch_wall,
+            "config": _STATUS_CONFIG,
+        })
+        return LatestStatus.response(rest)
     except Exception as e:
-        cache_headers = {
-            "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        }
-        return JSONResponse(content={"error": str(e), "timestamp": time.time()}, headers=cache_headers)
+        return FastJSONResponse(content={"error": str(e), "timestamp": time.time()}, headers=_NO_STORE_HEADERS)
 
-@app.get("/dashboard")
-async def live_dashboard():
+_DASHBOARD_PAGE = FilePage("dashboard.html")
+try:
+    _DASHBOARD_PAGE.get()  # al bij import inlezen: de eerste hit doet geen blocking read in de event loop
+except OSError:
+    pass
+
+async def live_dashboard(request: Request):
     """Live monitoring dashboard"""
-    with open("dashboard.html", "r") as f:
-        return HTMLResponse(content=f.read())
-
-@app.get("/")
-async def dashboard():
-    html = f"""
-    <!doctype html>
-    <html lang=\"nl\">
-    <head>
-      <meta charset=\"utf-8\" />
-      <meta name=\"viewport\" content=\"width=device-width, initial-scale=1\" />
-      <title>myenergi ↔ marstek</title>
-      <style>
-        body {{ font-family: -apple-system, system-ui, Segoe UI, Roboto, Helvetica, Arial, sans-serif; margin: 2rem; background: #0f172a; color: #e2e8f0; }}
-        .card {{ background:#111827; border:1px solid #374151; border-radius:12px; padding:16px; margin:12px 0; }}
-        .row {{ display:flex; gap:12px; flex-wrap:wrap; }}
-        .kpi {{ flex:1; min-width:220px; }}
-        .label {{ color:#94a3b8; font-size:12px; text-transform:uppercase; letter-spacing:.06em }}
-        .value {{ font-size:28px; font-weight:700; margin-top:6px; }}
-        .ok {{ color:#22c55e }} .warn {{ color:#f59e0b }} .bad {{ color:#ef4444 }}
-        button {{ background:#2563eb; color:#fff; border:0; padding:8px 12px; border-radius:8px; cursor:pointer; }}
-        button.secondary {{ background:#334155; }}
-        pre {{ white-space:pre-wrap; word-break:break-word; background:#0b1220; padding:12px; border-radius:8px; border:1px solid #1f2937; }}
-      </style>
-    </head>
-    <body>
-      <h1>myenergi ↔ marstek</h1>
-      <div style=\"margin:8px 0\">
-        <a href=\"/setup\" style=\"color:#93c5fd\">⚙️ Setup</a>
-      </div>
-      <div id=\"msg\"></div>
-      <div class=\"row\">
-        <div class=\"card kpi\">
-          <div class=\"label\">Grid</div>
-          <div class=\"value\" id=\"grid\">—</div>
-        </div>
-        <div class=\"card kpi\">
-          <div class=\"label\">Eddi vermogen</div>
-          <div class=\"value\" id=\"eddi\">—</div>
-        </div>
-        <div class=\"card kpi\">
-          <div class=\"label\">Batterij SoC</div>
-          <div class=\"value\" id=\"soc\">—</div>
-        </div>
-        <div class=\"card kpi\">
-          <div class=\"label\">Batterij status</div>
-          <div class=\"value\" id=\"blocked\">—</div>
-        </div>
-      </div>
-      <div class=\"card\">
-        <div class=\"row\">
-          <button onclick=\"send('allow')\">Allow charge</button>
-          <button class=\"secondary\" onclick=\"send('inhibit')\">Inhibit charge</button>
-          <button class=\"secondary\" onclick=\"send('status')\">Refresh status</button>
-        </div>
-      </div>
-      <div class=\"card\">
-        <div class=\"label\">Ruwe data</div>
-        <pre id=\"raw\"></pre>
-      </div>
-      <div class=\"card\">
-        <div class=\"label\">Eddi details</div>
-        <div id=\"eddi_details\"></div>
-      </div>
-      <div class=\"card\">
-        <div class=\"label\">Zappi details</div>
-        <div id=\"zappi_details\"></div>
-      </div>
-
-      <script>
-        async function refresh() {{
-          try {{
-            const r = await fetch('/api/status');
-            const j = await r.json();
-            const ge = j.derived.grid_export_w;
-            const ed = j.derived.eddi_power_w;
-            document.getElementById('grid').textContent =
-              ge == null ? '—' : `${{ge}} W`;
-            document.getElementById('grid').className = 'value ' + (ge == null ? '' : (ge >= 0 ? 'ok' : 'bad'));
-            document.getElementById('eddi').textContent = ed == null ? '—' : `${{ed}} W`;
-            document.getElementById('soc').textContent = j.battery.soc == null ? '—' : `${{j.battery.soc}} %`;
-            document.getElementById('blocked').textContent = j.battery.blocked ? 'Geblokkeerd' : 'Toegestaan';
-            document.getElementById('raw').textContent = JSON.stringify(j, null, 2);
-
-            // Eddi/Zappi detail parsing (cloud raw)
-            try {{
-              let eddi = null, zappi = null;
-              if (Array.isArray(j.myenergi.raw)) {{
-                for (const sect of j.myenergi.raw) {{
-                  if (sect.eddi && sect.eddi.length) eddi = sect.eddi[0];
-                  if (sect.zappi && sect.zappi.length) zappi = sect.zappi[0];
-                }}
-              }}
-              const eddiHtml = eddi ? `
-                <ul>
-                  <li><b>SN</b>: ${{eddi.sno ?? '—'}}</li>
-                  <li><b>Vermogen</b>: ${{(eddi.ectp1 ?? eddi.div ?? '—')}} W</li>
-                  <li><b>T1</b>: ${{eddi.tp1 ?? '—'}} °C</li>
-                  <li><b>T2</b>: ${{eddi.tp2 ?? '—'}} °C</li>
-                  <li><b>Spanning</b>: ${{eddi.vol ? (eddi.vol/10).toFixed(1)+' V' : '—'}}</li>
-                  <li><b>Status</b>: ${{eddi.sta ?? '—'}}</li>
-                </ul>` : '—';
-              document.getElementById('eddi_details').innerHTML = eddiHtml;
-
-              const zappiHtml = zappi ? `
-                <ul>
-                  <li><b>SN</b>: ${{zappi.sno ?? '—'}}</li>
-                  <li><b>Grid</b>: ${{zappi.grd ?? '—'}} W</li>
-                  <li><b>Gen</b>: ${{zappi.gen ?? '—'}} W</li>
-                  <li><b>Spanning</b>: ${{zappi.vol ? (zappi.vol/10).toFixed(1)+' V' : '—'}}</li>
-                  <li><b>Fase</b>: ${{zappi.phaseSetting ?? zappi.pha ?? '—'}}</li>
-                  <li><b>Mode</b>: ${{zappi.zmo ?? '—'}}</li>
-                </ul>` : '—';
-              document.getElementById('zappi_details').innerHTML = zappiHtml;
-            }} catch (e) {{ /* negeer parsing fouten */ }}
-          }} catch(e) {{
-            document.getElementById('msg').textContent = 'Fout bij ophalen status: ' + e;
-          }}
-        }}
-        async function send(action) {{
-          try {{
-            const r = await fetch('/api/control?action=' + action, {{ method: 'POST' }});
-            const j = await r.json();
-            document.getElementById('msg').textContent = JSON.stringify(j);
-            refresh();
-          }} catch(e) {{
-            document.getElementById('msg').textContent = 'Fout bij control: ' + e;
-          }}
-        }}
-        refresh();
-        setInterval(refresh, {int(POLL_INTERVAL_S*1000)});
-      </script>
-    </body>
-    </html>
-    """
-    return HTMLResponse(html)
+    return _DASHBOARD_PAGE.get().response(request)
+
+async def dashboard(request: Request):
+    return _INDEX_PAGE.response(request)
+
+app.add_route("/dashboard", live_dashboard, methods=["GET"], include_in_schema=False)
+app.add_route("/", dashboard, methods=["GET"], include_in_schema=False)
 
 # =========================
 # Setup wizard (zonder externe site)
 # =========================
-@app.get("/setup")
-async def setup_page():
-    html = f"""
-    <!doctype html>
-    <html lang=\"nl\">
-    <head>
-      <meta charset=\"utf-8\" />
-      <meta name=\"viewport\" content=\"width=device-width, initial-scale=1\" />
-      <title>Marstek Setup</title>
-      <style>
-        body {{ font-family: -apple-system, system-ui, Segoe UI, Roboto, Helvetica, Arial, sans-serif; margin: 2rem; background: #0f172a; color: #e2e8f0; }}
-        .card {{ background:#111827; border:1px solid #374151; border-radius:12px; padding:16px; margin:12px 0; }}
-        label {{ display:block; margin-top:8px; color:#cbd5e1; }}
-        input {{ width:100%; padding:8px; border-radius:8px; border:1px solid #334155; background:#0b1220; color:#e2e8f0; }}
-        button {{ background:#2563eb; color:#fff; border:0; padding:8px 12px; border-radius:8px; cursor:pointer; margin-top:12px; }}
-        .row {{ display:flex; gap:12px; flex-wrap:wrap; }}
-        pre {{ white-space:pre-wrap; word-break:break-word; background:#0b1220; padding:12px; border-radius:8px; border:1px solid #1f2937; }}
-      </style>
-    </head>
-    <body>
-      <h1>Marstek Setup (lokaal)</h1>
-      <div class="card">
-        <h3>Netwerk scan (snel alle poorten proberen)</h3>
-        <p>Scan het opgegeven IP met jouw eigen poorten (komma-gescheiden). Laat leeg voor standaardlijst.</p>
-        <label>IP(s) (comma-sep)</label>
-        <input id="scan_ip" placeholder="192.168.68.72,192.168.68.73,192.168.68.74,192.168.68.75" value="192.168.68.72" />
-        <label>Poorten (comma-sep)</label>
-        <input id="scan_ports" placeholder="30000,30001,8080,80,30002" value="30000,30001,8080,80,30002" />
-        <div class="row">
-          <button onclick="scanPorts()">Scan poorten</button>
-        </div>
-      </div>
-      <div class="card">
-        <div id="scan_result"></div>
-      </div>
-      <div class="card">
-        <p>Voer het lokale IP en poort van je Marstek in (bijv. 30000) en test de verbinding. Dit blijft op je eigen netwerk.</p>
-        <label>IP of host</label>
-        <input id="ip" placeholder="192.168.x.y" />
-        <label>Poort</label>
-        <input id="port" placeholder="30000" value="30000" />
-        <label>Token (optioneel)</label>
-        <input id="token" placeholder="(laat leeg indien niet nodig)" />
-        <div class="row">
-          <button onclick="testConn()">Test verbinding</button>
-          <button onclick="saveCfg()">Opslaan</button>
-        </div>
-      </div>
-      <div class=\"card\">
-        <div id=\"result\"></div>
-        <pre id=\"preview\"></pre>
-      </div>
-      <script>
-        async function scanPorts() {{
-          const ipsStr = document.getElementById('scan_ip').value.trim();
-          if (!ipsStr) {{ document.getElementById('scan_result').textContent = 'Vul IP(s) in'; return; }}
-          const ips = ipsStr.split(',').map(s => s.trim()).filter(Boolean);
-          const portsStr = (document.getElementById('scan_ports').value || '').trim();
-          let ports = undefined;
-          if (portsStr) {{
-            ports = portsStr.split(',').map(s => parseInt(s.trim(), 10)).filter(n => Number.isInteger(n) && n>0 && n<65536);
-            if (!ports.length) ports = undefined;
-          }}
-          document.getElementById('scan_result').textContent = 'Scanning...';
-          try {{
-            const r = await fetch('/api/marstek/scan', {{
-              method: 'POST', headers: {{'Content-Type':'application/json'}},
-              body: JSON.stringify({{ips: ips, ports: ports}})
-            }});
-            const j = await r.json();
-            document.getElementById('scan_result').innerHTML =
-              j.ok ? `<pre>${{JSON.stringify(j, null, 2)}}</pre>` : `Mislukt: ${{j.error}}`;
-            // Vul ook het IP-veld
-            if (ips && ips.length) document.getElementById('ip').value = ips[0];
-          }} catch(e) {{ document.getElementById('scan_result').textContent = 'Fout: ' + e; }}
-        }}
-        async function testConn() {{
-          const ip = document.getElementById('ip').value.trim();
-          const port = document.getElementById('port').value.trim();
-          const token = document.getElementById('token').value.trim();
-          if (!ip || !port) {{ document.getElementById('result').textContent = 'Vul IP en poort in'; return; }}
-          const base = `http://${{ip}}:${{port}}`;
-          try {{
-            const r = await fetch('/api/marstek/test', {{
-              method: 'POST', headers: {{'Content-Type':'application/json'}},
-              body: JSON.stringify({{ base_url: base, token }})
-            }});
-            const j = await r.json();
-            document.getElementById('result').textContent = j.ok ? 'Verbinding OK' : ('Mislukt: ' + (j.error||''));
-            document.getElementById('preview').textContent = JSON.stringify(j.sample||j, null, 2);
-          }} catch(e) {{ document.getElementById('result').textContent = 'Fout: ' + e; }}
-        }}
-        async function saveCfg() {{
-          const ip = document.getElementById('ip').value.trim();
-          const port = document.getElementById('port').value.trim();
-          const token = document.getElementById('token').value.trim();
-          if (!ip || !port) {{ document.getElementById('result').textContent = 'Vul IP en poort in'; return; }}
-          const base = `http://${{ip}}:${{port}}`;
-          try {{
-            const r = await fetch('/api/marstek/config', {{
-              method: 'POST', headers: {{'Content-Type':'application/json'}},
-              body: JSON.stringify({{ base_url: base, token }})
-            }});
-            const j = await r.json();
-            document.getElementById('result').textContent = j.ok ? 'Opgeslagen' : ('Mislukt: ' + (j.error||''));
-          }} catch(e) {{ document.getElementById('result').textContent = 'Fout: ' + e; }}
-        }}
-      </script>
-    </body>
-    </html>
-    """
-    return HTMLResponse(html)
+async def setup_page(request: Request):
+    return _SETUP_PAGE.response(request)
+
+app.add_route("/setup", setup_page, methods=["GET"], include_in_schema=False)
+
+# Setup-wizard test meestal herhaaldelijk dezelfde base: houd de laatste paar clients (pool + geleerde paden) vast
+_PROBE_CLIENTS_MAX = 8
+_probe_clients: "OrderedDict[Tuple[str, str], MarstekClient]" = OrderedDict()
+
+async def _client_for(base: str, token: str) -> MarstekClient:
+    """LRU van test-clients per (base, token); de oudste wordt gesloten zodra er meer dan _PROBE_CLIENTS_MAX zijn.
+    Altijd los van de `marstek` client van de regelaar: probe() zwiept over alle poorten en mag diens
+    geleerde endpoint (ook op disk) niet overschrijven."""
+    key = (base, token)
+    client = _probe_clients.pop(key, None)
+    if client is None:
+        client = MarstekClient(base, token, persist_endpoint=False)
+    _probe_clients[key] = client
+    while len(_probe_clients) > _PROBE_CLIENTS_MAX:
+        _, old = _probe_clients.popitem(last=False)
+        await old.aclose()
+    return client
+
+class TestReq(BaseModel):
+    base_url: str
+    token: str = ""
 
 @app.post("/api/marstek/test")
-async def marstek_test(payload: Dict[str, str] = Body(...)):
-    base = (payload.get("base_url") or "").rstrip("/")
-    token = payload.get("token") or ""
-    temp = MarstekClient(base, token)
+async def marstek_test(payload: TestReq):
+    base = payload.base_url.rstrip("/")
+    token = payload.token
+    temp = await _client_for(base, token)
     # Probeer uitgebreid te scannen naar juiste poort/pad
     result = await temp.probe()
     if result.get("ok"):
@@ -1578,74 +2083,114 @@ async def marstek_test(payload: Dict[str, str] = Body(...)):
     except Exception as e:
         return {"ok": False, "error": str(e), "tried": result.get("tried")}
 
+# Eén client voor alle scans: keepalive/DNS over poorten en paden heen, gesloten bij shutdown.
+# Pool zo groot als de maximale scan-concurrency: een probe wacht nooit op een pool-slot (PoolTimeout zou
+# als "geen hit" tellen) en elke poort houdt zijn keepalive verbinding tussen de paden. Korte expiry: na de
+# scan blijven er geen sockets naar tientallen apparaten open. Geen HTTP/2: de scan gaat over plain http://,
+# waar httpx alleen HTTP/1.1 spreekt (h2 wordt via TLS/ALPN onderhandeld).
+SCAN_CLIENT = httpx.AsyncClient(
+    timeout=2.0,
+    limits=httpx.Limits(
+        max_connections=SCAN_CONCURRENCY_MAX,
+        max_keepalive_connections=SCAN_CONCURRENCY_MAX,
+        keepalive_expiry=5.0,
+    ),
+)
+
+class ScanReq(BaseModel):
+    """Body van /api/marstek/scan; ongeldige poorten geven een 422 in plaats van stil de standaard."""
+    ip: Optional[str] = None
+    ips: List[str] = []
+    ports: Optional[conlist(conint(gt=0, lt=65536), max_length=32)] = None
+    concurrency: int = SCAN_CONCURRENCY_DEFAULT
+
 @app.post("/api/marstek/scan")
-async def marstek_scan(payload: Dict[str, Any] = Body(...)):
+async def marstek_scan(request: Request, payload: ScanReq):
     # Accept either a single 'ip' or a list of 'ips'
-    ip_single = (payload.get("ip") or "").strip()
-    ips_list = payload.get("ips") or ([] if not ip_single else [ip_single])
+    ip_single = (payload.ip or "").strip()
+    ips_list = payload.ips or ([] if not ip_single else [ip_single])
     if not ips_list:
         return {"ok": False, "error": "IP(s) ontbreken"}
 
     # Optional custom ports list, else default
-    custom_ports = payload.get("ports")
-    if isinstance(custom_ports, list):
-        try:
-            ports = [int(p) for p in custom_ports if int(p) > 0 and int(p) < 65536]
-        except Exception:
-            ports = [30000, 30001, 8080, 80, 30002]
-        if not ports:
-            ports = [30000, 30001, 8080, 80, 30002]
-    else:
-        ports = [30000, 30001, 8080, 80, 30002]
-
-    paths = [
-        "/api/overview",
-        "/overview",
-        "/api/status",
-        "/status",
-        "/api",
-        "/",
-    ]
+    ports = tuple(payload.ports) if payload.ports else _DEFAULT_SCAN_PORTS
+    paths = _SCAN_PATHS
 
     all_results: Dict[str, Any] = {"ok": False, "results": []}
-
-    for ip in ips_list:
-        ip = (ip or "").strip()
-        if not ip:
-            continue
-        ip_results = []
-        for port in ports:
-            base = f"http://{ip}:{port}"
-            for path in paths:
-                url = f"{base}{path}"
+    # Dubbele IP's (bv. uit een geplakte lijst) één keer scannen; volgorde blijft behouden
+    ips = list(dict.fromkeys(ip.strip() for ip in ips_list if ip.strip()))
+    targets = [(ip, port) for ip in ips for port in ports]
+
+    # Alle (ip, poort) combinaties tegelijk via SCAN_CLIENT, begrensd om poorten/FD's en de router te sparen
+    sem = asyncio.Semaphore(min(max(payload.concurrency, 1), SCAN_CONCURRENCY_MAX))
+
+    async def _probe_port(ip: str, port: int) -> List[Dict[str, Any]]:
+        """Paden van één ip:poort na elkaar: ze delen zo één keepalive verbinding, en een
+        geweigerde/verlopen connect slaat de overige paden over (poort dicht)."""
+        hits: List[Dict[str, Any]] = []
+        async with sem:
+            if not await tcp_open(ip, port):
+                return hits
+        for path in paths:
+            url = f"http://{ip}:{port}{path}"
+            async with sem:
                 try:
-                    async with httpx.AsyncClient(timeout=2.0) as client:
-                        r = await client.get(url)
-                        r.raise_for_status()
-                        # Try JSON
-                        try:
-                            sample = r.json()
-                            ip_results.append({
-                                "url": url,
-                                "status": r.status_code,
-                                "sample": sample,
-                                "type": "json"
-                            })
-                        except ValueError:
-                            # Plain text
-                            sample = r.text.strip()
-                            if sample:
-                                ip_results.append({
-                                    "url": url,
-                                    "status": r.status_code,
-                                    "sample": sample,
-                                    "type": "text"
-                                })
+                    r = await SCAN_CLIENT.get(url)
+                except (httpx.ConnectError, httpx.ConnectTimeout):
+                    break
                 except Exception:
                     continue
+            if not r.is_success:
+                continue
+            # JSON of platte tekst, op basis van content-type (lege tekst telt niet als hit)
+            typ, sample = sniff_body(r)
+            if typ == "json" or sample:
+                hits.append({"url": url, "status": r.status_code, "sample": sample, "type": typ})
+        return hits
+
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        # Streamend: hits per ip:poort als eigen regels zodra die klaar is, afgesloten met een samenvatting
+        async def _probe_ip(ip: str, port: int) -> List[Dict[str, Any]]:
+            return [{"ip": ip, **hit} for hit in await _probe_port(ip, port)]
+
+        async def _stream():
+            tasks = [asyncio.ensure_future(_probe_ip(ip, port)) for ip, port in targets]
+            n_hits = 0
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    try:
+                        hits = await next_done
+                    except Exception:
+                        continue  # één mislukte probe telt als geen hit, de rest van de scan loopt door
+                    for hit in hits:
+                        n_hits += 1
+                        yield json_dumps(hit) + b"\n"
+            finally:
+                # Client weg of klaar: niets laten doorlopen
+                for t in tasks:
+                    t.cancel()
+            summary: Dict[str, Any] = {"done": True, "ok": n_hits > 0, "hits": n_hits,
+                                       "tried_ports": ports, "tried_paths": paths}
+            if not n_hits:
+                summary["error"] = "Geen open poorten/paden gevonden"
+            yield json_dumps(summary) + b"\n"
+
+        # Geen caching/buffering onderweg (bv. nginx/ingress), anders komen de hits alsnog pas aan het eind.
+        # AcceptGZipMiddleware laat NDJSON ongecomprimeerd (GZipMiddleware flusht niet per regel).
+        return StreamingResponse(_stream(), media_type="application/x-ndjson",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    # return_exceptions: een onverwachte fout in één probe annuleert de rest niet (telt als geen hit)
+    per_target = await asyncio.gather(*(_probe_port(ip, port) for ip, port in targets), return_exceptions=True)
+
+    by_ip: Dict[str, List[Dict[str, Any]]] = {ip: [] for ip in ips}
+    for (ip, _), hits in zip(targets, per_target):
+        if isinstance(hits, list):
+            by_ip[ip].extend(hits)
+    for ip in ips:
         all_results["results"].append({
             "ip": ip,
-            "open_ports": ip_results,
+            "open_ports": by_ip[ip],
             "tried_ports": ports,
             "tried_paths": paths,
         })
@@ -1655,7 +2200,8 @@ async def marstek_scan(payload: Dict[str, Any] = Body(...)):
     all_results["ok"] = bool(any_hits)
     if not any_hits:
         all_results["error"] = "Geen open poorten/paden gevonden"
-    return all_results
+    # Direct als response: de geneste samples hoeven niet eerst door jsonable_encoder
+    return FastJSONResponse(all_results)
 
 # =========================
 # Control loop
@@ -1668,45 +2214,76 @@ async def control_loop():
       - Temp mode: Tank(s) niet op temperatuur → batterij blokkeren  
       - Failsafe: SoC < minimum → batterij toestaan (bescherming)
       - Configureerbaar per seizoen (tank 1/2, temperaturen)
+      - Adaptief poll-interval: snel rond drempels en na veranderingen, geleidelijk trager als alles stabiel is
     """
+    interval = POLL_INTERVAL_S
+    prev_export_w: Optional[int] = None
+    prev_soc: Optional[float] = None
     while True:
         try:
-            async with myenergi_lock:
-                m = await myenergi.status_all()
-            export_w = extract_grid_export_w(m)  # >0 = export
-            now = time.time()
-            
-            # Try to get battery SoC with timeout
-            soc = None
-            try:
-                soc = await asyncio.wait_for(marstek.get_soc(), timeout=1.0)
-            except:
-                pass  # Continue without battery data
+            # myenergi en batterij SoC tegelijk ophalen
+            m, overview = await sample_all(marstek_timeout=1.0)
+            if isinstance(m, Exception):
+                raise m
+            # Eén view per status; velden blijven Optional (None = onbekend → snel pollen, niet toelaten)
+            view = parse_myenergi(m)
+            export_w = view.grid_w  # >0 = export
+            now = time.monotonic()
+
+            # Zonder batterijdata gewoon doorgaan
+            soc = parse_marstek(overview).soc
+
+            # Volgende interval: geleidelijk teruglopen zolang export en SoC stil staan, tot het plafond
+            # op basis van de afstand tot de drempel; bij verandering of na een (ook handmatige) switch
+            # meteen weer snel pollen
+            steady = (
+                export_w is not None and prev_export_w is not None
+                and abs(export_w - prev_export_w) < POLL_STABLE_DELTA_W
+                and (soc is None) == (prev_soc is None)
+                and (soc is None or abs(soc - prev_soc) < 1)
+                and now - state.last_switch >= POLL_INTERVAL_MAX_S
+            )
+            ceiling = adaptive_poll_interval(export_w, view.eddi_w, prev_export_w)
+            interval = min(interval * POLL_BACKOFF_FACTOR, ceiling) if steady else POLL_INTERVAL_S
+            prev_export_w, prev_soc = export_w, soc
+
+            # Niets veranderd sinds de vorige tick: zelfde beslissing, decide overslaan
+            if state.unchanged_since_last_eval(view, soc, now):
+                await asyncio.sleep(interval)
+                continue
+            state.last_eval = (view, soc, state.battery_blocked, now)
 
             # Failsafe: Batterij beschermen bij lage SoC
             if soc is not None and soc < SOC_FAILSAFE_MIN:
-                if state.battery_blocked and state.cooldown_ok():
+                if state.battery_blocked and state.cooldown_ok(now):
                     ok = await marstek.allow_charge()
                     if ok:
                         state.battery_blocked = False
                         state.mark_switch()
-                        print(f"🔋 Failsafe: Battery allowed (SoC: {soc}% < {SOC_FAILSAFE_MIN}%)")
-                await asyncio.sleep(POLL_INTERVAL_S)
+                        control_log.info(f"🔋 Failsafe: Battery allowed (SoC: {soc}% < {SOC_FAILSAFE_MIN}%)")
+                        interval = POLL_INTERVAL_S
+                    else:
+                        state.last_eval = None  # volgende tick opnieuw proberen
+                await asyncio.sleep(interval)
                 continue
 
             # Hoofdlogica: myenergi prioriteit (Zappi > Eddi > Batterij)
-            should_block, reason = should_block_battery_for_priority(m, state.battery_blocked)
+            # Reden pas opbouwen bij een daadwerkelijke overgang
+            should_block, reason = block_decision(m, state.battery_blocked)
 
             # Batterij blokkeren voor Eddi prioriteit
             if should_block:
-                if not state.battery_blocked and state.cooldown_ok():
+                if not state.battery_blocked and state.cooldown_ok(now):
                     ok = await marstek.inhibit_charge()
                     if ok:
                         state.battery_blocked = True
                         state.mark_switch()
-                        print(f"🚫 Battery blocked: {reason}")
+                        control_log.info(f"🚫 Battery blocked: {reason()}")
+                        interval = POLL_INTERVAL_S
+                    else:
+                        state.last_eval = None  # volgende tick opnieuw proberen
                 state.export_over_threshold_since = None
-                await asyncio.sleep(POLL_INTERVAL_S)
+                await asyncio.sleep(interval)
                 continue
 
             # Eddi heeft geen prioriteit → batterij mag laden bij voldoende export
@@ -1721,22 +2298,54 @@ async def control_loop():
                 (now - state.export_over_threshold_since) >= STABLE_EXPORT_SECONDS
             )
 
-            if stable_ok and state.battery_blocked and state.cooldown_ok():
+            if stable_ok and state.battery_blocked and state.cooldown_ok(now):
                 ok = await marstek.allow_charge()
                 if ok:
                     state.battery_blocked = False
                     state.mark_switch()
-                    print(f"✅ Battery allowed: {reason}, stable export {export_w}W")
+                    control_log.info(f"✅ Battery allowed: {reason()}, stable export {export_w}W")
+                    interval = POLL_INTERVAL_S
+                else:
+                    state.last_eval = None  # volgende tick opnieuw proberen
 
-        except Exception:
-            # Rustig blijven bij netwerkfout; volgende tick opnieuw
-            pass
+        except asyncio.CancelledError:
+            # Shutdown: direct stoppen, niet als netwerkfout behandelen
+            raise
+        except Exception as e:
+            # Rustig blijven bij netwerkfout; volgende tick opnieuw (volledig)
+            control_log.debug(f"Control tick failed: {e!r}")
+            interval = POLL_INTERVAL_S
+            state.last_eval = None
 
-        await asyncio.sleep(POLL_INTERVAL_S)
+        await asyncio.sleep(interval)
 
 # =========================
 # BLE Endpoints
 # =========================
+# Een BLE round-trip kost honderden ms en dubbele verzoeken tegelijk verstoren de radio-link;
+# polls van dashboard/control loop binnen de TTL krijgen het laatste antwoord. De endpoints geven
+# dat direct als FastJSONResponse terug (alleen JSON-native waarden, geen jsonable_encoder nodig).
+BLE_CACHE_TTL_S = 2.5
+_ble_cache: Dict[str, tuple] = {}
+_ble_locks: Dict[str, asyncio.Lock] = {}
+
+async def _cached_ble(key: str, fetcher: Callable[[], Awaitable[Any]], ttl: float = BLE_CACHE_TTL_S) -> Any:
+    """Resultaat van `fetcher()` per key `ttl` seconden bewaren; één BLE-verzoek tegelijk per key."""
+    hit = _ble_cache.get(key)
+    if hit is not None and time.monotonic() - hit[0] < ttl:
+        return hit[1]
+    lock = _ble_locks.get(key)
+    if lock is None:
+        lock = _ble_locks[key] = asyncio.Lock()
+    async with lock:
+        # Wie op de lock wachtte, krijgt het resultaat van de voorganger
+        hit = _ble_cache.get(key)
+        if hit is not None and time.monotonic() - hit[0] < ttl:
+            return hit[1]
+        value = await fetcher()
+        _ble_cache[key] = (time.monotonic(), value)
+        return value
+
 @app.get("/api/ble/status")
 async def ble_battery_status():
     """Get battery status via integrated BLE"""
@@ -1745,8 +2354,8 @@ async def ble_battery_status():
     
     try:
         ble_client = get_ble_client()
-        status = await ble_client.get_battery_status()
-        return status
+        status = await _cached_ble("status", ble_client.get_battery_status)
+        return FastJSONResponse(status)
     except Exception as e:
         return {"error": str(e), "available": True}
 
@@ -1758,8 +2367,8 @@ async def ble_system_info():
     
     try:
         ble_client = get_ble_client()
-        info = await ble_client.get_system_info()
-        return info
+        info = await _cached_ble("info", ble_client.get_system_info)
+        return FastJSONResponse(info)
     except Exception as e:
         return {"error": str(e), "available": True}
 
@@ -1772,6 +2381,7 @@ async def ble_connect():
     try:
         ble_client = get_ble_client()
         success = await ble_client.connect()
+        _ble_cache.clear()
         return {"success": success, "connected": ble_client.is_connected}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -1793,7 +2403,7 @@ async def diagnostics_work_mode(payload: Dict[str, Any] = Body(default={})):
 
         report = {"attempts": [], "reads_before": {}, "reads_after": {}, "mode": mode}
         async with modbus_lock:
-            if not venus_modbus.connected and not venus_modbus.connect():
+            if not venus_modbus.connected and not await run_modbus(venus_modbus.connect):
                 return {"success": False, "error": "connect failed"}
 
             client = venus_modbus.client
@@ -1801,9 +2411,9 @@ async def diagnostics_work_mode(payload: Dict[str, Any] = Body(default={})):
             for addr in (42000, 42001, 35100):
                 try:
                     if addr >= 40000:
-                        rr = client.read_holding_registers(address=addr, count=1, slave=1)
+                        rr = await run_modbus(client.read_holding_registers, address=addr, count=1, slave=1)
                     else:
-                        rr = client.read_input_registers(address=addr, count=1, slave=1)
+                        rr = await run_modbus(client.read_input_registers, address=addr, count=1, slave=1)
                     if hasattr(rr, 'registers') and not rr.isError():
                         report["reads_before"][addr] = rr.registers[0]
                 except Exception:
@@ -1815,7 +2425,7 @@ async def diagnostics_work_mode(payload: Dict[str, Any] = Body(default={})):
             for unit in units_to_try:
                 for tok in en_tokens:
                     try:
-                        rr = client.write_register(address=42000, value=tok, unit=unit)
+                        rr = await run_modbus(client.write_register, address=42000, value=tok, unit=unit)
                         ok = (not getattr(rr, 'isError', lambda: False)())
                         report["attempts"].append({"addr": 42000, "val": tok, "unit": unit, "ok": ok})
                         if ok:
@@ -1830,7 +2440,7 @@ async def diagnostics_work_mode(payload: Dict[str, Any] = Body(default={})):
             wrote = False
             for unit in units_to_try:
                 try:
-                    rr = client.write_register(address=42001, value=mode, unit=unit)
+                    rr = await run_modbus(client.write_register, address=42001, value=mode, unit=unit)
                     ok = (not getattr(rr, 'isError', lambda: False)())
                     report["attempts"].append({"addr": 42001, "val": mode, "unit": unit, "ok": ok})
                     if ok:
@@ -1843,16 +2453,16 @@ async def diagnostics_work_mode(payload: Dict[str, Any] = Body(default={})):
             for addr in (42000, 42001, 35100):
                 try:
                     if addr >= 40000:
-                        rr = client.read_holding_registers(address=addr, count=1, slave=1)
+                        rr = await run_modbus(client.read_holding_registers, address=addr, count=1, slave=1)
                     else:
-                        rr = client.read_input_registers(address=addr, count=1, slave=1)
+                        rr = await run_modbus(client.read_input_registers, address=addr, count=1, slave=1)
                     if hasattr(rr, 'registers') and not rr.isError():
                         report["reads_after"][addr] = rr.registers[0]
                 except Exception:
                     report["reads_after"][addr] = None
 
             try:
-                venus_modbus.disconnect()
+                await run_modbus(venus_modbus.disconnect)
             except Exception:
                 pass
         report["success"] = True
@@ -1880,7 +2490,7 @@ async def api_set_work_mode(payload: Dict[str, Any] = Body(...)):
 
         # Serialize Modbus access like other endpoints
         async with modbus_lock:
-            result = venus_modbus.set_work_mode(mode)
+            result = await run_modbus(venus_modbus.set_work_mode, mode)
         return {"success": bool(result.get("ok")), **result}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -1898,6 +2508,7 @@ async def get_settings():
     try:
         ble_client = get_ble_client()
         await ble_client.disconnect()
+        _ble_cache.clear()
         return {"success": True, "connected": ble_client.is_connected}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -1905,28 +2516,75 @@ async def get_settings():
 # =========================
 # App lifecycle
 # =========================
+_leader_lock_fd: Optional[int] = None
+
+def acquire_leader_lock() -> bool:
+    """Non-blocking file lock: precies één worker (proces) wordt leider van de regelloop."""
+    global _leader_lock_fd
+    try:
+        import fcntl
+    except ImportError:
+        return True  # Windows: geen multi-worker fork, dus altijd leider
+    fd = os.open(os.path.join(MARSTEK_STATE_DIR, "control_loop.lock"), os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _leader_lock_fd = fd  # open houden zolang het proces leeft
+    return True
+
+@app.on_event("startup")
+async def startup_event():
+    """Regelloop alleen starten als CONTROL_LOOP_LEADER=1 en deze worker de leader-lock heeft."""
+    if CONTROL_LOOP_LEADER and acquire_leader_lock():
+        app.state.control_task = asyncio.create_task(control_loop())
+        logger.info(f"🎛️  Control loop started (leader pid {os.getpid()})")
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
-    print("🛑 Shutting down myenergi-marstek integration...")
+    logger.info("🛑 Shutting down myenergi-marstek integration...")
+
+    # Regelloop eerst stoppen, zodat hij geen clients meer gebruikt die hieronder sluiten
+    task = getattr(app.state, "control_task", None)
+    if task is not None and not task.done():
+        task.cancel()
+        await asyncio.wait({task}, timeout=2)
+        logger.info("🎛️  Control loop stopped")
+    
+    try:
+        # Disconnect Modbus clients (via hun worker-thread, na een eventueel lopende call)
+        for client, executor, lock in ((venus_modbus, modbus_executor, modbus_lock),
+                                       (venus_modbus2, modbus_executor2, modbus_lock2)):
+            async with lock:
+                if client.connected:
+                    await run_modbus(client.disconnect, executor=executor)
+            executor.shutdown(wait=False)
+        logger.info("📡 Modbus client disconnected")
+    except Exception as e:
+        logger.warning(f"⚠️  Modbus cleanup warning: {e}")
     
     try:
-        # Disconnect Modbus client
-        if venus_modbus and venus_modbus.connected:
-            venus_modbus.disconnect()
-            print("📡 Modbus client disconnected")
+        # Gedeelde HTTP clients (keepalive pools) sluiten
+        await myenergi.aclose()
+        await marstek.aclose()
+        await SCAN_CLIENT.aclose()
+        while _probe_clients:
+            await _probe_clients.popitem()[1].aclose()
+        logger.info("🌐 HTTP clients closed")
     except Exception as e:
-        print(f"⚠️  Modbus cleanup warning: {e}")
+        logger.warning(f"⚠️  HTTP cleanup warning: {e}")
     
     try:
         # BLE cleanup if available
         if BLE_AVAILABLE:
             await cleanup_ble_client()
-            print("🔵 BLE client cleaned up")
+            logger.info("🔵 BLE client cleaned up")
     except Exception as e:
-        print(f"⚠️  BLE cleanup warning: {e}")
+        logger.warning(f"⚠️  BLE cleanup warning: {e}")
     
-    print("✅ Shutdown complete")
+    logger.info("✅ Shutdown complete")
 
 # =========================
 # Battery Modbus Endpoints
@@ -1937,29 +2595,15 @@ async def get_battery_status():
     try:
         # Serialize access to the Modbus client to avoid broken pipes
         async with modbus_lock:
-            battery_data = venus_modbus.read_battery_data()
-            # Use short session: disconnect after a full read to prevent stale sockets
-            try:
-                venus_modbus.disconnect()
-            except Exception:
-                pass
+            # Verbinding blijft open; read_battery_data herverbindt zelf bij een dode socket
+            battery_data = await run_modbus(venus_modbus.read_battery_data)
         
         if battery_data:
             # Derived energy metrics
-            soc = None
-            try:
-                soc = float(battery_data.get("soc_percent", {}).get("value"))
-            except Exception:
-                soc = None
+            soc = _to_float(battery_data.get("soc_percent", {}).get("value"))
             # Compute power from Modbus values
-            try:
-                v = float(battery_data.get("battery_voltage", {}).get("value", 0.0))
-            except Exception:
-                v = 0.0
-            try:
-                i = float(battery_data.get("battery_current", {}).get("value", 0.0))
-            except Exception:
-                i = 0.0
+            v = _to_float(battery_data.get("battery_voltage", {}).get("value"), 0.0)
+            i = _to_float(battery_data.get("battery_current", {}).get("value"), 0.0)
             calc_power_w = v * i
             # Prefer device-reported battery power if present
             raw_bp = battery_data.get("battery_power", {})
@@ -2011,27 +2655,13 @@ async def get_battery2_status():
     """Get real-time battery 2 status via Modbus (WiFi converter)."""
     try:
         async with modbus_lock2:
-            battery_data = venus_modbus2.read_battery_data()
-            try:
-                venus_modbus2.disconnect()
-            except Exception:
-                pass
+            battery_data = await run_modbus(venus_modbus2.read_battery_data, executor=modbus_executor2)
 
         if battery_data:
             # Derived energy metrics
-            soc = None
-            try:
-                soc = float(battery_data.get("soc_percent", {}).get("value"))
-            except Exception:
-                soc = None
-            try:
-                v = float(battery_data.get("battery_voltage", {}).get("value", 0.0))
-            except Exception:
-                v = 0.0
-            try:
-                i = float(battery_data.get("battery_current", {}).get("value", 0.0))
-            except Exception:
-                i = 0.0
+            soc = _to_float(battery_data.get("soc_percent", {}).get("value"))
+            v = _to_float(battery_data.get("battery_voltage", {}).get("value"), 0.0)
+            i = _to_float(battery_data.get("battery_current", {}).get("value"), 0.0)
             calc_power_w = v * i
             raw_bp = battery_data.get("battery_power", {})
             power_w = raw_bp.get("value") if isinstance(raw_bp, dict) else None
@@ -2103,10 +2733,12 @@ async def api_check_minimum_soc(payload: Dict[str, Any] = Body(...)):
         save_battery_config(config)
         
         if auto_charge:
-            result = venus_modbus.check_minimum_soc(min_soc)
+            async with modbus_lock:
+                result = await run_modbus(venus_modbus.check_minimum_soc, min_soc)
         else:
             # Just check, don't take action
-            battery_data = venus_modbus.read_battery_data()
+            async with modbus_lock:
+                battery_data = await run_modbus(venus_modbus.read_battery_data)
             if not battery_data or "soc_percent" not in battery_data:
                 return {"success": False, "error": "Could not read SoC data"}
             
@@ -2138,24 +2770,15 @@ async def set_battery_control(payload: Dict[str, Any] = Body(...)):
         async with modbus_lock:
             # Enforce SoC reserve for discharge
             try:
-                bd = venus_modbus.read_battery_data()
-                try:
-                    venus_modbus.disconnect()
-                except Exception:
-                    pass
+                bd = await run_modbus(venus_modbus.read_battery_data)
             except Exception:
                 bd = None
-            current_soc = None
-            try:
-                if bd:
-                    current_soc = float(bd.get("soc_percent", {}).get("value"))
-            except Exception:
-                current_soc = None
+            current_soc = _to_float(bd.get("soc_percent", {}).get("value")) if bd else None
 
             if action == "discharge" and current_soc is not None and current_soc <= MIN_SOC_RESERVE:
                 return {"success": False, "error": f"blocked by reserve: SoC {current_soc:.1f}% <= {MIN_SOC_RESERVE}%"}
 
-            result = venus_modbus.set_control(action, power_w)
+            result = await run_modbus(venus_modbus.set_control, action, power_w)
         return {"success": bool(result.get("ok")), **result}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -2165,11 +2788,7 @@ async def get_battery_raw():
     """Return raw Modbus battery data for debugging mapping/scaling."""
     try:
         async with modbus_lock:
-            data = venus_modbus.read_battery_data()
-            try:
-                venus_modbus.disconnect()
-            except Exception:
-                pass
+            data = await run_modbus(venus_modbus.read_battery_data)
         return {"success": True, "data": data}
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -2183,26 +2802,26 @@ async def battery_ping():
         async with modbus_lock:
             # Open connection
             if not venus_modbus.connected:
-                venus_modbus.connect()
+                await run_modbus(venus_modbus.connect)
             ok = venus_modbus.connected
             # Try a lightweight read using both keyword styles
             addr = 30000
             val = None
             try:
-                rr = venus_modbus.client.read_input_registers(address=addr, count=1, unit=1)
+                rr = await run_modbus(venus_modbus.client.read_input_registers, address=addr, count=1, unit=1)
                 if hasattr(rr, 'registers') and not rr.isError():
                     val = rr.registers[0]
             except Exception:
                 pass
             if val is None:
                 try:
-                    rr2 = venus_modbus.client.read_input_registers(address=addr, count=1, slave=1)
+                    rr2 = await run_modbus(venus_modbus.client.read_input_registers, address=addr, count=1, slave=1)
                     if hasattr(rr2, 'registers') and not rr2.isError():
                         val = rr2.registers[0]
                 except Exception:
                     pass
             try:
-                venus_modbus.disconnect()
+                await run_modbus(venus_modbus.disconnect)
             except Exception:
                 pass
         return {"success": ok, "host": venus_modbus.host, "port": venus_modbus.port, "sample": {"address": addr, "value": val}}
@@ -2223,13 +2842,13 @@ async def modbus_read_many(addrs: str, fn: str = Query("holding"), unit: int = Q
         results = []
         async with modbus_lock:
             if not venus_modbus.connected:
-                venus_modbus.connect()
+                await run_modbus(venus_modbus.connect)
             for a in addresses:
                 val = None
                 attempts = []
                 # Try 'unit' style
                 try:
-                    rr = venus_modbus.client.read_holding_registers(address=a, count=1, unit=unit)
+                    rr = await run_modbus(venus_modbus.client.read_holding_registers, address=a, count=1, unit=unit)
                     ok = (not getattr(rr, 'isError', lambda: False)()) and hasattr(rr, 'registers')
                     attempts.append({"style": "unit", "ok": ok})
                     if ok:
@@ -2239,7 +2858,7 @@ async def modbus_read_many(addrs: str, fn: str = Query("holding"), unit: int = Q
                 # If still no val, try 'slave' style
                 if val is None:
                     try:
-                        rr2 = venus_modbus.client.read_holding_registers(address=a, count=1, slave=unit)
+                        rr2 = await run_modbus(venus_modbus.client.read_holding_registers, address=a, count=1, slave=unit)
                         ok2 = (not getattr(rr2, 'isError', lambda: False)()) and hasattr(rr2, 'registers')
                         attempts.append({"style": "slave", "ok": ok2})
                         if ok2:
@@ -2250,7 +2869,7 @@ async def modbus_read_many(addrs: str, fn: str = Query("holding"), unit: int = Q
                 if delay_ms:
                     await asyncio.sleep(delay_ms/1000.0)
             try:
-                venus_modbus.disconnect()
+                await run_modbus(venus_modbus.disconnect)
             except Exception:
                 pass
         return {"success": True, "values": results}
@@ -2273,7 +2892,7 @@ async def scan_battery_registers(start: int = 30000, count: int = 80, kind: str
     result = {"success": False, "host": venus_modbus.host, "port": venus_modbus.port, "start": start, "count": count, "kind": kind, "values": {}}
     try:
         async with modbus_lock:
-            if not venus_modbus.connect():
+            if not await run_modbus(venus_modbus.connect):
                 result["error"] = "connect failed"
                 return result
             try:
@@ -2281,16 +2900,16 @@ async def scan_battery_registers(start: int = 30000, count: int = 80, kind: str
                 for addr in range(start, start + count):
                     try:
                         if kind == "holding":
-                            rr = client.read_holding_registers(addr, 1, unit=1)
+                            rr = await run_modbus(client.read_holding_registers, addr, 1, unit=1)
                         else:
-                            rr = client.read_input_registers(addr, 1, unit=1)
+                            rr = await run_modbus(client.read_input_registers, addr, 1, unit=1)
                         if rr and not rr.isError():
                             result["values"][addr] = rr.registers[0]
                     except Exception:
                         continue
             finally:
                 try:
-                    venus_modbus.disconnect()
+                    await run_modbus(venus_modbus.disconnect)
                 except Exception:
                     pass
         result["success"] = True
@@ -2328,7 +2947,7 @@ async def read_many(addrs: str, fn: str = "input", unit: int = 1, delay_ms: int
         unit_id = int(unit)
         wait = max(0, int(delay_ms)) / 1000.0
         async with modbus_lock:
-            if not venus_modbus.connect():
+            if not await run_modbus(venus_modbus.connect):
                 return {"success": False, "error": "connect failed"}
             try:
                 client = venus_modbus.client
@@ -2336,9 +2955,9 @@ async def read_many(addrs: str, fn: str = "input", unit: int = 1, delay_ms: int
                     raw = None
                     try:
                         if fn == "holding":
-                            rr = client.read_holding_registers(addr, 1, unit=unit_id)
+                            rr = await run_modbus(client.read_holding_registers, addr, 1, unit=unit_id)
                         else:
-                            rr = client.read_input_registers(addr, 1, unit=unit_id)
+                            rr = await run_modbus(client.read_input_registers, addr, 1, unit=unit_id)
                         if rr and not rr.isError():
                             raw = rr.registers[0]
                     except Exception:
@@ -2353,11 +2972,10 @@ async def read_many(addrs: str, fn: str = "input", unit: int = 1, delay_ms: int
                             fmt = {"value": raw, "formatted": str(raw)}
                         out[addr] = {"ok": True, "raw": raw, "formatted": fmt}
                     if wait:
-                        import time as _t
-                        _t.sleep(wait)
+                        await asyncio.sleep(wait)
             finally:
                 try:
-                    venus_modbus.disconnect()
+                    await run_modbus(venus_modbus.disconnect)
                 except Exception:
                     pass
         return {"success": True, "values": out}
@@ -2368,13 +2986,15 @@ async def read_many(addrs: str, fn: str = "input", unit: int = 1, delay_ms: int
 async def test_battery_connection():
     """Test Modbus connection to battery"""
     try:
-        connected = venus_modbus.connect()
-        
+        # Zelfde socket als de diagnose-endpoints: connect/lees/disconnect niet door elkaar laten lopen
+        async with modbus_lock:
+            connected = await run_modbus(venus_modbus.connect)
+            if connected:
+                # Quick test read
+                test_data = await run_modbus(venus_modbus.read_battery_data)
+                await run_modbus(venus_modbus.disconnect)
+
         if connected:
-            # Quick test read
-            test_data = venus_modbus.read_battery_data()
-            venus_modbus.disconnect()
-            
             return {
                 "success": True,
                 "connected": True,
@@ -2411,18 +3031,19 @@ async def restart_application():
         import asyncio
         
         # Clean shutdown first
-        print("🔄 Restart requested via API")
+        logger.info("🔄 Restart requested via API")
         
         # Schedule restart after response is sent
         async def delayed_restart():
             await asyncio.sleep(2)  # Give time for response to be sent
-            print("🔄 Initiating restart...")
+            logger.info("🔄 Initiating restart...")
             
             # Clean disconnect
             try:
-                if venus_modbus and venus_modbus.connected:
-                    venus_modbus.disconnect()
-            except:
+                async with modbus_lock:
+                    if venus_modbus and venus_modbus.connected:
+                        await run_modbus(venus_modbus.disconnect)
+            except Exception:
                 pass
             
             # Send SIGTERM for clean shutdown
@@ -2455,7 +3076,7 @@ async def marstek_allow_manual():
         if result:
             state.battery_blocked = False
             state.mark_switch()
-            print("✅ Manual battery allow")
+            logger.info("✅ Manual battery allow")
         return {"ok": result, "action": "allow", "timestamp": time.time()}
     except Exception as e:
         return {"ok": False, "error": str(e), "action": "allow"}
@@ -2468,7 +3089,7 @@ async def marstek_inhibit_manual():
         if result:
             state.battery_blocked = True
             state.mark_switch()
-            print("🚫 Manual battery block")
+            logger.info("🚫 Manual battery block")
         return {"ok": result, "action": "inhibit", "timestamp": time.time()}
     except Exception as e:
         return {"ok": False, "error": str(e), "action": "inhibit"}
@@ -2496,10 +3117,10 @@ async def mqtt_publish(payload: Dict[str, str] = Body(...)):
         ], capture_output=True, text=True, timeout=5)
         
         if result.returncode == 0:
-            print(f"📡 MQTT Published: {topic} = {message}")
+            logger.debug(f"📡 MQTT Published: {topic} = {message}")
             return {"success": True, "topic": topic, "message": message}
         else:
-            print(f"❌ MQTT Publish failed: {result.stderr}")
+            logger.error(f"❌ MQTT Publish failed: {result.stderr}")
             return {"success": False, "error": result.stderr}
             
     except subprocess.TimeoutExpired:
@@ -2513,7 +3134,7 @@ async def mqtt_publish(payload: Dict[str, str] = Body(...)):
 @app.get("/api/batteries/discover")
 async def discover_batteries():
     """Discover all available batteries"""
-    print("🔍 API: Starting battery discovery...")
+    logger.info("🔍 API: Starting battery discovery...")
     try:
         # Import battery discovery
         import sys
@@ -2523,12 +3144,12 @@ async def discover_batteries():
         discovery = BatteryDiscovery()
         batteries = await discovery.discover_all()
         
-        print(f"✅ API: Discovery complete - {batteries.get('total', 0)} batteries found")
-        print(f"📊 API: BLE: {len(batteries.get('ble', []))}, Network: {len(batteries.get('network', []))}")
+        logger.info(f"✅ API: Discovery complete - {batteries.get('total', 0)} batteries found")
+        logger.info(f"📊 API: BLE: {len(batteries.get('ble', []))}, Network: {len(batteries.get('network', []))}")
         
         return batteries
     except Exception as e:
-        print(f"❌ API: Discovery failed - {e}")
+        logger.error(f"❌ API: Discovery failed - {e}")
         import traceback
         traceback.print_exc()
         return {"error": str(e), "ble": [], "network": [], "total": 0}
@@ -2560,6 +3181,7 @@ async def connect_to_battery(payload: Dict[str, str] = Body(...)):
                 ip, port = ip_port
                 # Update marstek client to use this IP
                 global marstek
+                await marstek.aclose()
                 marstek = MarstekClient(f"http://{ip}:{port}", "")
                 return {"success": True, "type": "network", "name": f"{ip}:{port}"}
             else:
@@ -2648,8 +3270,7 @@ class SimpleRulesEngine:
             # Only execute rules if we are in rules mode
             if target_mode == "manual_rules" and active_rules:
                 # Get current system data
-                myenergi_data = await self.get_myenergi_data()
-                battery_data = await self.get_battery_data()
+                myenergi_data, battery_data = await self.get_system_data()
                 
                 if myenergi_data and battery_data:
                     for rule in active_rules:
@@ -2671,8 +3292,7 @@ class SimpleRulesEngine:
             rules_data = load_energy_rules()
             
             # Get current system data
-            myenergi_data = await self.get_myenergi_data()
-            battery_data = await self.get_battery_data()
+            myenergi_data, battery_data = await self.get_system_data()
             
             if not myenergi_data or not battery_data:
                 return
@@ -2742,12 +3362,17 @@ class SimpleRulesEngine:
             logger.error(f"Failed to get MyEnergi data: {e}")
             return None
     
+    async def get_system_data(self):
+        """myenergi en batterij tegelijk ophalen; elk deel is None als die bron faalt."""
+        return await asyncio.gather(self.get_myenergi_data(), self.get_battery_data())
+
     async def get_battery_data(self):
         """Get battery data."""
         try:
-            soc = await asyncio.wait_for(marstek.get_soc(), timeout=2.0)
+            battery = await asyncio.wait_for(marstek.get_status_bulk(), timeout=2.0)
             return {
-                "soc": soc.value if soc and hasattr(soc, "value") else 0
+                "soc": battery.soc if battery.soc is not None else 0,
+                "power_w": battery.power_w,
             }
         except Exception as e:
             logger.error(f"Failed to get battery data: {e}")
@@ -2957,8 +3582,7 @@ async def debug_rules_engine():
         active_rules = [r for r in rules_data.get("rules", []) if r.get("active", False)]
         
         # Get current system data
-        myenergi_data = await rules_engine.get_myenergi_data()
-        battery_data = await rules_engine.get_battery_data()
+        myenergi_data, battery_data = await rules_engine.get_system_data()
         
         # Determine what mode should be active
         target_mode = await mode_manager.determine_target_mode(len(active_rules) > 0)
@@ -3012,8 +3636,7 @@ class EnhancedSimpleRulesEngine(SimpleRulesEngine):
                 logger.info("🔍 RULES DEBUG: Executing rules in manual_rules mode")
                 
                 # Get current system data
-                myenergi_data = await self.get_myenergi_data()
-                battery_data = await self.get_battery_data()
+                myenergi_data, battery_data = await self.get_system_data()
                 
                 if myenergi_data and battery_data:
                     logger.info(f"🔍 RULES DEBUG: MyEnergi data: {myenergi_data}")
@@ -3157,3 +3780,14 @@ class EnhancedSimpleRulesEngine(SimpleRulesEngine):
 # Replace the rules engine
 rules_engine = EnhancedSimpleRulesEngine()
 
+if __name__ == "__main__":
+    import uvicorn
+    # loop/http "auto" kiezen uvloop en httptools als die geïnstalleerd zijn (uvicorn[standard])
+    uvicorn.run(
+        "app:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        loop="auto",
+        http="auto",
+        workers=WEB_WORKERS,
+    )
@@ -33,7 +33,7 @@ source venv/bin/activate
 # Install Python packages
 echo "📚 Installing Python packages..."
 pip install --upgrade pip
-pip install fastapi uvicorn paho-mqtt pymodbus aiofiles jinja2 python-multipart
+pip install fastapi "uvicorn[standard]" paho-mqtt pymodbus aiofiles jinja2 python-multipart
 
 # Create app structure
 echo "📂 Creating app structure..."
@@ -0,0 +1,83 @@
+async function scanPorts() {
+  const ipsStr = document.getElementById('scan_ip').value.trim();
+  if (!ipsStr) { document.getElementById('scan_result').textContent = 'Vul IP(s) in'; return; }
+  const ips = ipsStr.split(',').map(s => s.trim()).filter(Boolean);
+  const portsStr = (document.getElementById('scan_ports').value || '').trim();
+  let ports = undefined;
+  if (portsStr) {
+    ports = portsStr.split(',').map(s => parseInt(s.trim(), 10)).filter(n => Number.isInteger(n) && n>0 && n<65536);
+    if (!ports.length) ports = undefined;
+  }
+  const out = document.getElementById('scan_result');
+  out.textContent = 'Scanning...';
+  try {
+    const r = await fetch('/api/marstek/scan', {
+      method: 'POST', headers: {'Content-Type':'application/json', 'Accept':'application/x-ndjson'},
+      body: JSON.stringify({ips: ips, ports: ports})
+    });
+    if (!(r.headers.get('content-type') || '').includes('ndjson')) {
+      // Validatiefout e.d. komt als gewone JSON terug
+      const j = await r.json();
+      out.innerHTML = j.ok ? `<pre>${JSON.stringify(j, null, 2)}</pre>` : `Mislukt: ${j.error || JSON.stringify(j.detail)}`;
+      return;
+    }
+    // Hits tonen zodra ze binnenkomen (één JSON object per regel)
+    const pre = document.createElement('pre');
+    out.textContent = 'Scanning... (hits verschijnen hieronder)';
+    out.appendChild(pre);
+    const reader = r.body.getReader();
+    const dec = new TextDecoder();
+    let buf = '';
+    for (;;) {
+      const {value, done} = await reader.read();
+      if (done) break;
+      buf += dec.decode(value, {stream: true});
+      let nl;
+      while ((nl = buf.indexOf('\n')) >= 0) {
+        const line = buf.slice(0, nl).trim();
+        buf = buf.slice(nl + 1);
+        if (!line) continue;
+        const j = JSON.parse(line);
+        if (j.done) {
+          out.firstChild.textContent = j.ok ? `Klaar: ${j.hits} hit(s)` : `Mislukt: ${j.error}`;
+        } else {
+          // Alleen de nieuwe hit toevoegen; textContent += zou de hele lijst opnieuw opbouwen
+          pre.appendChild(document.createTextNode(JSON.stringify(j, null, 2) + '\n'));
+        }
+      }
+    }
+    // Vul ook het IP-veld
+    if (ips && ips.length) document.getElementById('ip').value = ips[0];
+  } catch(e) { out.textContent = 'Fout: ' + e; }
+}
+async function testConn() {
+  const ip = document.getElementById('ip').value.trim();
+  const port = document.getElementById('port').value.trim();
+  const token = document.getElementById('token').value.trim();
+  if (!ip || !port) { document.getElementById('result').textContent = 'Vul IP en poort in'; return; }
+  const base = `http://${ip}:${port}`;
+  try {
+    const r = await fetch('/api/marstek/test', {
+      method: 'POST', headers: {'Content-Type':'application/json'},
+      body: JSON.stringify({ base_url: base, token })
+    });
+    const j = await r.json();
+    document.getElementById('result').textContent = j.ok ? 'Verbinding OK' : ('Mislukt: ' + (j.error||''));
+    document.getElementById('preview').textContent = JSON.stringify(j.sample||j, null, 2);
+  } catch(e) { document.getElementById('result').textContent = 'Fout: ' + e; }
+}
+async function saveCfg() {
+  const ip = document.getElementById('ip').value.trim();
+  const port = document.getElementById('port').value.trim();
+  const token = document.getElementById('token').value.trim();
+  if (!ip || !port) { document.getElementById('result').textContent = 'Vul IP en poort in'; return; }
+  const base = `http://${ip}:${port}`;
+  try {
+    const r = await fetch('/api/marstek/config', {
+      method: 'POST', headers: {'Content-Type':'application/json'},
+      body: JSON.stringify({ base_url: base, token })
+    });
+    const j = await r.json();
+    document.getElementById('result').textContent = j.ok ? 'Opgeslagen' : ('Mislukt: ' + (j.error||''));
+  } catch(e) { document.getElementById('result').textContent = 'Fout: ' + e; }
+}
@@ -251,6 +251,40 @@ def format_value(address: int, raw_value: int) -> dict:
         "unit": reg_info["unit"]
     }
 
+def make_formatter(address: int):
+    """format_value voor één vast adres: registerinfo (schaal, eenheid, signed, enum) wordt
+    één keer opgezocht; de teruggegeven functie doet per waarde alleen nog het rekenwerk."""
+    reg_info = get_register_info(address)
+    if not reg_info:
+        return lambda raw_value: {"value": raw_value, "formatted": str(raw_value)}
+
+    signed = reg_info.get("signed", False)
+    scale = reg_info["scale"]
+    unit = reg_info["unit"]
+    description = reg_info["description"]
+    values = reg_info.get("values")
+    is_float = isinstance(scale, float)
+
+    def fmt(raw_value: int) -> dict:
+        if signed and raw_value > 32767:
+            raw_value = raw_value - 65536
+        scaled_value = raw_value * scale
+        if values is not None and raw_value in values:
+            formatted = values[raw_value]
+        elif is_float:
+            formatted = f"{scaled_value:.1f} {unit}" if unit else f"{scaled_value:.1f}"
+        else:
+            formatted = f"{scaled_value} {unit}" if unit else str(scaled_value)
+        return {
+            "value": scaled_value,
+            "raw": raw_value,
+            "formatted": formatted,
+            "description": description,
+            "unit": unit
+        }
+
+    return fmt
+
 if __name__ == "__main__":
     print("🔋 Venus E v2 Register Map")
     print("=" * 40)